@@ -0,0 +1,173 @@
+import csv
+import itertools
+import math
+import os
+import time
+
+import numpy as np
+
+import checkpoint
+import parallel
+import tax
+
+DEFAULT_CHUNK_SIZE = 100000
+
+def guessDelimiter(path):
+    return "\t" if os.path.splitext(path)[1].lower() in (".tsv", ".tab") else ","
+
+def parseColumn(values):
+    # blank or malformed cells become nan and are passed through as blanks
+    try:
+        return np.array(values, dtype=float)
+    except ValueError:
+        parsed = np.empty(len(values))
+        for i, value in enumerate(values):
+            try:
+                parsed[i] = float(value)
+            except ValueError:
+                parsed[i] = np.nan
+        return parsed
+
+def formatColumn(values):
+    text = np.char.mod("%.2f", values)
+    return np.where(np.isnan(values), "", text)
+
+def outputColumns(basis):
+    if basis == "gross":
+        return ["net_income", "tax_paid"]
+    if basis == "net":
+        return ["gross_income", "tax_paid"]
+    raise ValueError(f"basis must be 'gross' or 'net', got {basis!r}")
+
+def processChunk(values, basis="gross", schedule=None, engine=None):
+    # Returns (other side of the income, tax paid) for one chunk of incomes.
+    # Only the income is mapped; the tax follows from it in this process, exactly
+    # as taxPaidGrossArray/taxPaidNetArray derive it.
+    if basis not in ("gross", "net"):
+        raise ValueError(f"basis must be 'gross' or 'net', got {basis!r}")
+    function = "netIncome" if basis == "gross" else "netIncomeInverse"
+    if engine is not None:
+        other = engine.map(function, values)
+    else:
+        other = getattr(tax.resolveSchedule(schedule), parallel.BATCH_METHODS[function])(values)
+    with np.errstate(invalid="ignore"):
+        if basis == "gross":
+            return other, tax._roundCents(values - other)
+        return other, tax._roundCents(other - values)
+
+def readChunks(reader, index, chunk_size):
+    rows = []
+    for row in reader:
+        rows.append(row)
+        if len(rows) == chunk_size:
+            yield rows, parseColumn([row[index] if index < len(row) else "" for row in rows])
+            rows = []
+    if rows:
+        yield rows, parseColumn([row[index] if index < len(row) else "" for row in rows])
+
+def columnIndex(header, column):
+    if column in header:
+        return header.index(column)
+    if column.isdigit() and int(column) < len(header):
+        return int(column)
+    raise ValueError(f"column {column!r} not found in header {header}")
+
+def processFile(input_path, output_path, column="income", basis="gross",
+                chunk_size=DEFAULT_CHUNK_SIZE, schedule=None, delimiter=None, workers=1,
+                cache=None, resume=False):
+    # Streams input_path to output_path chunk by chunk, appending the computed
+    # columns to every row. Only one chunk is held in memory at a time.
+    # With workers > 1 each chunk is split across a process pool.
+    # cache (a checkpoint.ResultCache or a directory) reuses the results of
+    # chunks already computed. Progress is journalled after every chunk, and
+    # resume=True picks an interrupted run up from its last complete chunk.
+    if chunk_size < 1:
+        raise ValueError(f"chunk size must be positive, got {chunk_size}")
+    schedule = tax.resolveSchedule(schedule)
+    if isinstance(cache, (str, os.PathLike)):
+        cache = checkpoint.ResultCache(cache)
+    delimiter = delimiter or guessDelimiter(input_path)
+    info = os.stat(input_path)
+    journal = checkpoint.Journal(output_path, {
+        "input": os.path.abspath(input_path), "input_size": info.st_size, "input_mtime": info.st_mtime_ns,
+        "column": column, "basis": basis, "chunk_size": chunk_size, "delimiter": delimiter,
+        "schedule": schedule.fingerprint(),
+    })
+    resumed = resume and journal.load() and os.path.exists(output_path) and os.path.getsize(output_path) >= journal.offset
+    if resumed:
+        # drop anything written after the last complete chunk
+        os.truncate(output_path, journal.offset)
+    else:
+        journal.chunks = journal.rows = journal.offset = 0
+    engine = None
+    if workers > 1:
+        # split every full chunk, however small the chunks are set
+        engine = parallel.ParallelEngine(schedule, workers, min(parallel.MIN_PARALLEL_SIZE, chunk_size))
+    start = time.perf_counter()
+    count = 0
+    try:
+        with open(input_path, newline="") as infile, \
+                open(output_path, "a" if resumed else "w", newline="") as outfile:
+            reader = csv.reader(infile, delimiter=delimiter)
+            writer = csv.writer(outfile, delimiter=delimiter)
+            header = next(reader, None)
+            if header is None:
+                raise ValueError(f"{input_path} is empty")
+            index = columnIndex(header, column)
+            if not resumed:
+                writer.writerow(header + outputColumns(basis))
+            for _ in itertools.islice(reader, journal.rows):
+                pass
+            chunks, rows_done = journal.chunks, journal.rows
+            for rows, values in readChunks(reader, index, chunk_size):
+                key = cached = None
+                if cache is not None:
+                    key = checkpoint.chunkKey(values, basis, schedule)
+                    cached = cache.get(key)
+                if cached is not None:
+                    other, paid = cached
+                else:
+                    other, paid = processChunk(values, basis, schedule, engine)
+                    if cache is not None:
+                        cache.put(key, np.stack([other, paid]))
+                writer.writerows(
+                    row + [a, b] for row, a, b in zip(rows, formatColumn(other), formatColumn(paid))
+                )
+                outfile.flush()
+                chunks += 1
+                rows_done += len(rows)
+                count += len(rows)
+                journal.record(chunks, rows_done, outfile.tell())
+        journal.finish()
+    finally:
+        if engine is not None:
+            engine.close()
+    seconds = time.perf_counter() - start
+    summary = {
+        "rows": count,
+        "seconds": seconds,
+        "rows_per_sec": count/seconds if seconds > 0 else math.inf,
+        "resumed_rows": journal.rows - count if resumed else 0,
+    }
+    if cache is not None:
+        summary["cache"] = cache.stats()
+    return summary
+
+def formatSummary(summary):
+    text = f"Processed {summary['rows']} rows in {summary['seconds']:.2f}s ({summary['rows_per_sec']:,.0f} rows/sec)"
+    if summary.get("resumed_rows"):
+        text += f", resuming after {summary['resumed_rows']} rows"
+    if "cache" in summary:
+        text += "\n" + checkpoint.formatStats(summary["cache"])
+    return text
+
+def run(args):
+    summary = processFile(
+        args.input, args.output, column=args.column, basis=args.basis,
+        chunk_size=args.chunk_size, schedule=args.schedule, delimiter=args.delimiter,
+        workers=args.workers,
+        cache=checkpoint.ResultCache(args.cache, int(args.cache_max_mb*2**20)) if args.cache else None,
+        resume=args.resume
+    )
+    print(formatSummary(summary))
+    return summary
@@ -0,0 +1,274 @@
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import timeit
+
+import numpy as np
+
+import tax
+import withholding
+
+# Benchmarks for the public functions, plus a differential check of the fast
+# paths against the original linear-scan implementation.
+#
+#     python bench.py --output bench.json
+#     python bench.py --baseline bench.json --threshold 0.25
+
+SIZES = [10**i for i in range(8)]
+BRACKET_COUNTS = [5, 20, 100]
+SWEEP_INCOMES = 300000
+
+def referenceNetIncome(income, brackets, rates):
+    # tax.netIncome as originally written, before the compiled schedules
+    if income < brackets[0]:
+        return "You're in debt!"
+    if income <= brackets[1]:
+        return income
+    for i in brackets:
+        if income <= brackets[i]:
+            nat_accum = [(1- rates[j])*(brackets[j] - brackets[j-1]) for j in range(1, i)]
+            net = sum(nat_accum) + (income - brackets[i-1])*(1-rates[i])
+            return round(net, 2)
+
+def referenceNetIncomeInverse(net_income, brackets, rates):
+    if net_income <= 0:
+        return "Get outta here!"
+
+    bracket = 0
+    for i in brackets:
+        if net_income <= brackets[i]:
+            bracket = i
+            break
+
+    def solver(index):
+        if index == 1:
+            return net_income
+
+        threshhold = brackets[index-1]
+        rate = 1-rates[index]
+
+        tot_income = (net_income - referenceNetIncome(threshhold, brackets, rates) + rate*(threshhold))/rate
+        if tot_income <= brackets[index]:
+            return tot_income
+        else:
+            return solver(index + 1)
+
+    return solver(bracket)
+
+def syntheticSchedule(count):
+    # count brackets from a tax-free threshold up to 45%, in the shape of tax_brackets/tax_rates
+    brackets = {0: 0}
+    rates = {}
+    for i in range(1, count):
+        brackets[i] = 18200*i
+        rates[i] = round(0.45*(i - 1)/(count - 1), 4)
+    brackets[count] = math.inf
+    rates[count] = 0.45
+    return brackets, rates
+
+# the notebook's helpers, as written in bracketcreep.ipynb
+
+def marginalValue(income):
+    for i in tax.tax_brackets:
+        if income <= tax.tax_brackets[i]:
+            return 1-tax.tax_rates[i]
+
+def aveReturn(income):
+    return tax.netIncome(income)/income
+
+def premium(income):
+    average = aveReturn(income)
+    marginal = marginalValue(income)
+    percentage = (average - marginal)/average
+    percentage = 100*percentage
+    return round(percentage, 2)
+
+def bestOf(repeat, function, *args):
+    # seconds per call; small cases are looped (as timeit does) so they stay above timer noise
+    timer = timeit.Timer(lambda: function(*args))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number))/number
+
+def sampleIncomes(size, schedule, seed=0):
+    top = 2*max(upper for upper in schedule.uppers if upper != math.inf)
+    return np.random.default_rng(seed).uniform(0, top, size)
+
+def benchFunctions(sizes, bracket_counts, max_scalar_size, repeat):
+    results = []
+    for count in bracket_counts:
+        schedule = tax.TaxSchedule(*syntheticSchedule(count)) if count != len(tax.tax_rates) else tax.default_schedule
+        for size in sizes:
+            incomes = sampleIncomes(size, schedule)
+            nets = schedule.netIncomeArray(incomes)
+            cases = [
+                ("netIncomeArray", schedule.netIncomeArray, incomes),
+                ("netIncomeInverseArray", schedule.netIncomeInverseArray, nets),
+                ("taxPaidGrossArray", schedule.taxPaidGrossArray, incomes),
+                ("taxPaidNetArray", schedule.taxPaidNetArray, nets),
+            ]
+            if size <= max_scalar_size:
+                income_list = incomes.tolist()
+                net_list = [net for net in nets.tolist() if net > 0]
+                cases += [
+                    ("netIncome", lambda xs: [schedule.netIncome(x) for x in xs], income_list),
+                    ("netIncomeInverse", lambda xs: [schedule.netIncomeInverse(x) for x in xs], net_list),
+                    ("taxPaidGross", lambda xs: [schedule.taxPaidGross(x) for x in xs], income_list),
+                    ("taxPaidNet", lambda xs: [schedule.taxPaidNet(x) for x in xs], net_list),
+                ]
+            for name, function, values in cases:
+                seconds = bestOf(repeat, function, values)
+                results.append(record(name, size, count, seconds))
+    return results
+
+def benchSweeps(repeat):
+    # the 300k-point sweeps behind the notebook's figures
+    schedule = tax.default_schedule
+    income_list = list(range(1, SWEEP_INCOMES + 1))
+    incomes = np.arange(1, SWEEP_INCOMES + 1, dtype=float)
+    count = len(schedule.uppers)
+    results = []
+    for name, scalar, array in [
+        ("aveReturn", aveReturn, schedule.aveReturnArray),
+        ("marginalValue", marginalValue, schedule.marginalValueArray),
+        ("premium", premium, schedule.premiumArray),
+    ]:
+        seconds = bestOf(repeat, lambda xs: [scalar(x) for x in xs], income_list)
+        results.append(record("sweep." + name, SWEEP_INCOMES, count, seconds))
+        seconds = bestOf(repeat, array, incomes)
+        results.append(record("sweep." + name + "Array", SWEEP_INCOMES, count, seconds))
+        seconds = bestOf(repeat, tax.sampleCurve, name, 1, SWEEP_INCOMES)
+        results.append(record("sweep." + name + "Curve", SWEEP_INCOMES, count, seconds))
+    return results
+
+def record(name, size, brackets, seconds):
+    return {
+        "name": name,
+        "size": size,
+        "brackets": brackets,
+        "seconds": seconds,
+        "per_second": size/seconds if seconds > 0 else math.inf
+    }
+
+def differentialCheck(bracket_counts, size, seed=0):
+    # Fast paths must agree exactly with the reference implementation. Returns
+    # a list of mismatch descriptions, empty when everything agrees.
+    failures = []
+    rng = random.Random(seed)
+    for count in bracket_counts:
+        brackets, rates = syntheticSchedule(count) if count != len(tax.tax_rates) else (tax.tax_brackets, tax.tax_rates)
+        schedule = tax.TaxSchedule(brackets, rates)
+        edges = [b + d for b in brackets.values() if b != math.inf for d in (-0.01, 0, 0.01, 1) if b + d >= 0]
+        incomes = edges + [rng.uniform(0, 2*edges[-1]) for _ in range(size)] + [rng.randrange(0, 10**8)/100 for _ in range(size)]
+        nets = [referenceNetIncome(x, brackets, rates) for x in incomes]
+        nets = [net for net in nets if not isinstance(net, str) and net > 0]
+        checks = [
+            ("netIncome", incomes, schedule.netIncome, schedule.netIncomeArray,
+             lambda x: referenceNetIncome(x, brackets, rates)),
+            ("netIncomeInverse", nets, schedule.netIncomeInverse, schedule.netIncomeInverseArray,
+             lambda x: referenceNetIncomeInverse(x, brackets, rates)),
+            ("taxPaidGross", incomes, schedule.taxPaidGross, schedule.taxPaidGrossArray,
+             lambda x: round(x - referenceNetIncome(x, brackets, rates), 2)),
+            ("taxPaidNet", nets, schedule.taxPaidNet, schedule.taxPaidNetArray,
+             lambda x: round(referenceNetIncomeInverse(x, brackets, rates) - x, 2)),
+        ]
+        for name, values, scalar, array, reference in checks:
+            vectorized = array(np.array(values, dtype=float)).tolist()
+            # the inverse is unrounded, and the reference solves against rounded
+            # threshold net incomes, so it is compared to well within a cent
+            same = (lambda a, b: math.isclose(a, b, rel_tol=1e-12, abs_tol=1e-9)) if name == "netIncomeInverse" else (lambda a, b: a == b)
+            for value, fast in zip(values, vectorized):
+                expected = reference(value)
+                if not (same(scalar(value), expected) and same(fast, expected)):
+                    failures.append(f"{name}({value!r}) with {count} brackets: expected {expected!r}, scalar {scalar(value)!r}, array {fast!r}")
+                    break
+    incomes = np.arange(1, SWEEP_INCOMES + 1, dtype=float)
+    for name, notebook, scalar, array in [
+        ("aveReturn", aveReturn, tax.aveReturn, tax.aveReturnArray),
+        ("marginalValue", marginalValue, tax.marginalValue, tax.marginalValueArray),
+        ("premium", premium, tax.premium, tax.premiumArray),
+    ]:
+        expected = np.array([notebook(x) for x in range(1, SWEEP_INCOMES + 1)])
+        for form, fast in [("scalar", np.array([scalar(x) for x in range(1, SWEEP_INCOMES + 1)])), ("array", array(incomes))]:
+            if not np.array_equal(fast, expected):
+                failures.append(f"sweep.{name}: {form} sweep differs from the notebook at {int(np.argmax(fast != expected)) + 1}")
+    # one pay event at a time must withhold exactly what a whole pay run does
+    ids = np.arange(size)
+    single = withholding.WithholdingTracker()
+    run = withholding.WithholdingTracker()
+    for pay_run in range(4):
+        grosses = [6422.49] + [rng.randrange(0, 2*10**6)/100 for _ in range(size - 1)]
+        one_by_one = [single.apply(int(i), gross) for i, gross in zip(ids, grosses)]
+        together = run.applyRun(ids, grosses).tolist()
+        if one_by_one != together:
+            i = next(i for i, (a, b) in enumerate(zip(one_by_one, together)) if a != b)
+            failures.append(f"withholding run {pay_run}: apply gave {one_by_one[i]!r} for {grosses[i]!r}, applyRun {together[i]!r}")
+            break
+    # an employee first seen after a restore must start from nothing, like in a fresh tracker
+    restored = withholding.WithholdingTracker()
+    restored.applyRun([1, 2, 3], [1000.0, 2000.0, 3000.0])
+    saved = restored.snapshot()
+    restored.applyRun([4], [9000.0])
+    restored.restore(saved)
+    after, fresh = restored.apply(4, 1000.0), withholding.WithholdingTracker().apply(4, 1000.0)
+    if after != fresh:
+        failures.append(f"withholding after restore: new employee withheld {after!r}, a fresh tracker {fresh!r}")
+    return failures
+
+def compareBaseline(results, baseline, threshold):
+    # a result regresses when it is slower than its baseline by more than threshold
+    previous = {(r["name"], r["size"], r["brackets"]): r["seconds"] for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        key = (result["name"], result["size"], result["brackets"])
+        if key in previous and result["seconds"] > previous[key]*(1 + threshold):
+            regressions.append({**result, "baseline_seconds": previous[key], "ratio": result["seconds"]/previous[key]})
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmark the tax module")
+    parser.add_argument("--max-size", type=int, default=10**7, help="largest batch size to time")
+    parser.add_argument("--max-scalar-size", type=int, default=10**5, help="largest size to time with scalar loops")
+    parser.add_argument("--brackets", type=int, nargs="+", default=BRACKET_COUNTS, help="bracket counts to time")
+    parser.add_argument("--repeat", type=int, default=3, help="timings per case, the best is kept")
+    parser.add_argument("--check-size", type=int, default=20000, help="random inputs per differential check")
+    parser.add_argument("--skip-sweeps", action="store_true", help="skip the notebook sweeps")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown against the baseline")
+    args = parser.parse_args(argv)
+
+    failures = differentialCheck(args.brackets, args.check_size)
+    sizes = [size for size in SIZES if size <= args.max_size]
+    results = benchFunctions(sizes, args.brackets, args.max_scalar_size, args.repeat)
+    if not args.skip_sweeps:
+        results += benchSweeps(args.repeat)
+
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "results": results,
+        "check_failures": failures,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = compareBaseline(results, json.load(f), args.threshold)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    for failure in failures:
+        print("MISMATCH " + failure, file=sys.stderr)
+    for regression in report.get("regressions", []):
+        print(f"REGRESSION {regression['name']} size={regression['size']} brackets={regression['brackets']}: "
+              f"{regression['ratio']:.2f}x baseline", file=sys.stderr)
+    return 1 if failures or report.get("regressions") else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
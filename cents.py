@@ -0,0 +1,137 @@
+import math
+from bisect import bisect_left
+from fractions import Fraction
+from functools import lru_cache
+
+import numpy as np
+
+import tax
+
+# Exact integer engine. Incomes and thresholds are whole cents, and rates are
+# fractions over a common denominator, so tax is accumulated without error and
+# rounded to the cent once at the end. Totals then reconcile to the cent with
+# no Decimal post-pass.
+#
+#     cents.taxCents(5138900)                 # $51,389.00 -> 716843
+#     cents.netIncomeCentsArray(incomes_in_cents, schedule="2019-20")
+
+ROUNDING_MODES = ("half_up", "half_even", "down")
+RATE_DENOMINATOR_LIMIT = 10**6
+
+# stands in for an infinite top threshold in int64 arrays
+NO_CEILING = np.iinfo(np.int64).max
+
+def toCents(amounts):
+    # Dollars (scalar or array) to int64 cents. Both forms take the exact value
+    # of the input and round it to the nearest cent, ties to even: for a float
+    # that is its binary value, so toCents(x) == round(x, 2)*100 and 1.015
+    # (stored as 1.01499999...) gives 101. Strings and Decimals are exact as written.
+    if np.ndim(amounts) == 0:
+        exact = Fraction(amounts) if isinstance(amounts, float) else Fraction(str(amounts))
+        return int(round(exact*100))
+    return tax._cents(amounts).astype(np.int64)
+
+def fromCents(cents):
+    if np.ndim(cents) == 0:
+        return cents/100
+    return np.asarray(cents)/100
+
+def _divide(scaled, denominator, rounding):
+    # scaled/denominator rounded to an integer, for ints and int64 arrays alike
+    if rounding == "down":
+        return scaled//denominator
+    quotient, remainder = scaled//denominator, scaled % denominator
+    if rounding == "half_up":
+        return quotient + (2*remainder >= denominator)
+    if rounding == "half_even":
+        return quotient + ((2*remainder > denominator) | ((2*remainder == denominator) & (quotient % 2 == 1)))
+    raise ValueError(f"rounding must be one of {ROUNDING_MODES}, got {rounding!r}")
+
+class CentsSchedule:
+    # Bracket j covers (lowers[j], uppers[j]] in cents, taxed at
+    # numerators[j]/denominator. tax_at[j] is the tax below lowers[j], scaled by the denominator.
+
+    def __init__(self, brackets, rates, rounding="half_up"):
+        if rounding not in ROUNDING_MODES:
+            raise ValueError(f"rounding must be one of {ROUNDING_MODES}, got {rounding!r}")
+        self.rounding = rounding
+        indices = sorted(brackets)
+        # exact for rates with up to six decimal places; combined schedules can carry
+        # float noise such as 0.29000000000000004, which this snaps back to 29/100
+        fractions = [Fraction(str(rates[i])).limit_denominator(RATE_DENOMINATOR_LIMIT) for i in indices[1:]]
+        self.denominator = math.lcm(*(fraction.denominator for fraction in fractions))
+        self.numerators = [int(fraction*self.denominator) for fraction in fractions]
+        thresholds = [NO_CEILING if brackets[i] == math.inf else toCents(brackets[i]) for i in indices]
+        self.floor = thresholds[0]
+        self.lowers = thresholds[:-1]
+        self.uppers = thresholds[1:]
+
+        self.tax_at = []
+        scaled = 0
+        for lower, upper, numerator in zip(self.lowers, self.uppers, self.numerators):
+            self.tax_at.append(scaled)
+            if upper != NO_CEILING:
+                scaled += numerator*(upper - lower)
+
+        # largest income whose scaled tax still fits in int64
+        self.max_array_income = (NO_CEILING - max(self.tax_at))//max(max(self.numerators), 1)
+
+        self.lower_array = np.array(self.lowers, dtype=np.int64)
+        self.upper_array = np.array(self.uppers, dtype=np.int64)
+        self.numerator_array = np.array(self.numerators, dtype=np.int64)
+        self.tax_at_array = np.array(self.tax_at, dtype=np.int64)
+
+    @classmethod
+    def fromSchedule(cls, schedule, rounding="half_up"):
+        brackets, rates = schedule.definition()
+        return cls(brackets, rates, rounding)
+
+    def taxCents(self, income):
+        if income < self.floor:
+            raise ValueError(f"income must be at least {self.floor} cents, got {income}")
+        j = bisect_left(self.uppers, income)
+        scaled = self.tax_at[j] + self.numerators[j]*(income - self.lowers[j])
+        return _divide(scaled, self.denominator, self.rounding)
+
+    def netIncomeCents(self, income):
+        return income - self.taxCents(income)
+
+    def taxCentsArray(self, incomes):
+        incomes = np.asarray(incomes, dtype=np.int64)
+        if incomes.size and (incomes.min() < self.floor or incomes.max() > self.max_array_income):
+            raise ValueError(f"incomes must lie in [{self.floor}, {self.max_array_income}] cents")
+        j = np.searchsorted(self.upper_array, incomes)
+        scaled = self.tax_at_array[j] + self.numerator_array[j]*(incomes - self.lower_array[j])
+        return _divide(scaled, self.denominator, self.rounding).astype(np.int64)
+
+    def netIncomeCentsArray(self, incomes):
+        incomes = np.asarray(incomes, dtype=np.int64)
+        return incomes - self.taxCentsArray(incomes)
+
+    def totalTaxCents(self, incomes):
+        # exact total as a Python int, with no float anywhere
+        return int(self.taxCentsArray(incomes).sum(dtype=np.int64))
+
+@lru_cache(maxsize=tax.SCHEDULE_CACHE_SIZE)
+def _centsSchedule(schedule, rounding):
+    return CentsSchedule.fromSchedule(schedule, rounding)
+
+def resolveCentsSchedule(schedule=None, rounding="half_up"):
+    if isinstance(schedule, CentsSchedule):
+        return schedule
+    return _centsSchedule(tax.resolveSchedule(schedule), rounding)
+
+def taxCents(income, schedule=None, rounding="half_up"):
+    return resolveCentsSchedule(schedule, rounding).taxCents(income)
+
+def netIncomeCents(income, schedule=None, rounding="half_up"):
+    return resolveCentsSchedule(schedule, rounding).netIncomeCents(income)
+
+def taxCentsArray(incomes, schedule=None, rounding="half_up"):
+    return resolveCentsSchedule(schedule, rounding).taxCentsArray(incomes)
+
+def netIncomeCentsArray(incomes, schedule=None, rounding="half_up"):
+    return resolveCentsSchedule(schedule, rounding).netIncomeCentsArray(incomes)
+
+def totalTaxCents(incomes, schedule=None, rounding="half_up"):
+    return resolveCentsSchedule(schedule, rounding).totalTaxCents(incomes)
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+# Checkpointing for batch runs.
+#
+# ResultCache keeps the computed columns of each chunk in its own file, named
+# by a hash of the chunk's input values, the basis and the schedule's
+# fingerprint. Other columns of the file don't enter the key, so editing them
+# still hits. Files are written to a temporary name and renamed, so a killed
+# run never leaves a half-written entry. The least recently used entries are
+# evicted once the cache grows past max_bytes.
+#
+# A Journal records how many chunks of an output file are complete and how
+# long the file was at that point, so an interrupted run can truncate back to
+# the last whole chunk and carry on from there.
+#
+#     cache = checkpoint.ResultCache("cache/", max_bytes=2**30)
+#     batch.processFile("in.csv", "out.csv", cache=cache, resume=True)
+#     cache.report()
+
+DEFAULT_MAX_BYTES = 2**30
+SUFFIX = ".npy"
+
+def chunkKey(values, basis, schedule):
+    digest = hashlib.sha256()
+    digest.update(schedule.fingerprint().encode())
+    digest.update(basis.encode())
+    digest.update(np.ascontiguousarray(values, dtype="<f8").tobytes())
+    return digest.hexdigest()
+
+class ResultCache:
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        # key -> (bytes, last used), seeded from whatever earlier runs left
+        self.entries = {}
+        for name in os.listdir(directory):
+            if name.endswith(SUFFIX):
+                info = os.stat(os.path.join(directory, name))
+                self.entries[name[:-len(SUFFIX)]] = (info.st_size, info.st_mtime)
+        self.size = sum(size for size, _ in self.entries.values())
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def get(self, key):
+        # the cached columns for key, or None
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        try:
+            columns = np.load(self.path(key))
+        except (OSError, ValueError):
+            # removed or damaged behind our back; treat as a miss
+            self._drop(key)
+            self.misses += 1
+            return None
+        now = time.time()
+        os.utime(self.path(key), (now, now))
+        self.entries[key] = (self.entries[key][0], now)
+        self.hits += 1
+        return columns
+
+    def put(self, key, columns):
+        path = self.path(key)
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as f:
+            np.save(f, np.asarray(columns))
+        os.replace(temporary, path)
+        if key in self.entries:
+            self.size -= self.entries[key][0]
+        size = os.path.getsize(path)
+        self.entries[key] = (size, time.time())
+        self.size += size
+        self._evict(keep=key)
+
+    def _drop(self, key):
+        size, _ = self.entries.pop(key)
+        self.size -= size
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, keep=None):
+        if self.size <= self.max_bytes:
+            return
+        for key in sorted(self.entries, key=lambda key: self.entries[key][1]):
+            if self.size <= self.max_bytes:
+                break
+            if key != keep:
+                self._drop(key)
+                self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits/lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.size,
+        }
+
+    def report(self):
+        return formatStats(self.stats())
+
+def formatStats(stats):
+    return (f"Cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), "
+            f"{stats['evictions']} evicted, {stats['entries']} entries, {stats['bytes']/2**20:,.1f} MiB")
+
+class Journal:
+    # <output>.checkpoint beside the output file, rewritten atomically after every chunk
+
+    def __init__(self, output_path, settings):
+        self.path = output_path + ".checkpoint"
+        self.settings = settings
+        self.chunks = 0
+        self.rows = 0
+        self.offset = 0
+
+    def load(self):
+        # progress from an earlier run with the same settings, or nothing
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if saved.get("settings") != self.settings:
+            return False
+        self.chunks, self.rows, self.offset = saved["chunks"], saved["rows"], saved["offset"]
+        return True
+
+    def record(self, chunks, rows, offset):
+        self.chunks, self.rows, self.offset = chunks, rows, offset
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump({"settings": self.settings, "chunks": chunks, "rows": rows, "offset": offset}, f)
+        os.replace(temporary, self.path)
+
+    def finish(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
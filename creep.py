@@ -0,0 +1,86 @@
+import numpy as np
+
+import tax
+
+# Bracket creep over a population. Incomes grow with wages each year while
+# the schedule's thresholds grow by the indexation policy (nothing, by default).
+# Every dollar amount in a schedule scales with its thresholds, so the tax
+# under thresholds indexed by f is f*tax(income/f). The whole years x persons
+# grid is therefore one broadcast against the base schedule, evaluated in
+# blocks of at most max_cells so the full matrix is never materialised.
+#
+#     for year in creep.simulate(incomes, [0.03]*20):
+#         print(year["year"], year["average_rate"])
+
+DEFAULT_MAX_CELLS = 2**22
+
+def growthFactors(rates, years):
+    # cumulative factors for years 0..years; year 0 is the base year
+    rates = np.broadcast_to(np.asarray(rates, dtype=float), (years,))
+    return np.concatenate([[1.0], np.cumprod(1 + rates)])
+
+def indexationRates(indexation, wage_growth):
+    # None or 0: thresholds frozen; "wages": thresholds follow wage growth;
+    # a number: a constant annual rate; a sequence: one rate per year
+    if indexation is None:
+        return np.zeros(len(wage_growth))
+    if isinstance(indexation, str):
+        if indexation == "wages":
+            return np.asarray(wage_growth, dtype=float)
+        raise ValueError(f"unknown indexation policy {indexation!r}")
+    return np.broadcast_to(np.asarray(indexation, dtype=float), (len(wage_growth),))
+
+def simulate(incomes, wage_growth, indexation=None, schedule=None, weights=None,
+             max_cells=DEFAULT_MAX_CELLS):
+    # Yields one dict of aggregates per year, for years 0..len(wage_growth):
+    # revenue, total income, average rate, and the weighted share of persons
+    # in each bracket.
+    schedule = tax.resolveSchedule(schedule)
+    incomes = np.asarray(incomes, dtype=float).reshape(-1)
+    weights = np.ones_like(incomes) if weights is None else np.asarray(weights, dtype=float).reshape(-1)
+    if weights.shape != incomes.shape:
+        raise ValueError("weights must match incomes")
+    wage_growth = np.asarray(wage_growth, dtype=float).reshape(-1)
+    years = len(wage_growth)
+    wages = growthFactors(wage_growth, years)
+    thresholds = growthFactors(indexationRates(indexation, wage_growth), years)
+    ratios = wages/thresholds
+    brackets = len(schedule.uppers)
+    population = weights.sum()
+
+    year_block = max(1, min(years + 1, max_cells // max(len(incomes), 1)))
+    person_block = max(1, max_cells // year_block)
+    for first in range(0, years + 1, year_block):
+        block = slice(first, min(first + year_block, years + 1))
+        rows = ratios[block]
+        revenue = np.zeros(len(rows))
+        shares = np.zeros((len(rows), brackets))
+        for start in range(0, len(incomes), person_block):
+            chunk = incomes[start:start + person_block]
+            chunk_weights = weights[start:start + person_block]
+            # incomes in base-year threshold dollars
+            scaled = rows[:, None]*chunk[None, :]
+            revenue += schedule.taxArray(scaled) @ chunk_weights
+            j = schedule.bracketArray(scaled) + brackets*np.arange(len(rows))[:, None]
+            shares += np.bincount(j.ravel(), np.broadcast_to(chunk_weights, j.shape).ravel(),
+                                  minlength=len(rows)*brackets).reshape(len(rows), brackets)
+        base_income = incomes @ weights
+        for offset, year in enumerate(range(block.start, block.stop)):
+            # back from base-year threshold dollars to that year's dollars
+            year_revenue = revenue[offset]*thresholds[year]
+            total_income = base_income*wages[year]
+            yield {
+                "year": year,
+                "wage_index": wages[year],
+                "threshold_index": thresholds[year],
+                "revenue": year_revenue,
+                "total_income": total_income,
+                "average_rate": year_revenue/total_income if total_income else 0.0,
+                "bracket_shares": shares[offset]/population if population else shares[offset],
+            }
+
+def creepTable(incomes, wage_growth, indexation=None, schedule=None, weights=None,
+               max_cells=DEFAULT_MAX_CELLS):
+    # simulate(), collected into one array per aggregate
+    rows = list(simulate(incomes, wage_growth, indexation, schedule, weights, max_cells))
+    return {key: np.array([row[key] for row in rows]) for key in rows[0]}
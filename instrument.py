@@ -0,0 +1,270 @@
+import functools
+import math
+import threading
+import time
+from bisect import bisect_left
+
+import numpy as np
+
+import lookup
+import tax
+
+# Opt-in instrumentation. enable() swaps timed wrappers in for the calculation
+# methods of TaxSchedule and LookupTable, and disable() puts the originals
+# back, so when it is off nothing at all runs in between. The module-level
+# functions in tax, the batch runner and the service all go through these
+# methods, so they are covered too. Only the outermost call is recorded:
+# taxPaidGross calling netIncome counts once, as taxPaidGross.
+#
+# Each thread records into its own counters, merged on export, so recording
+# takes no lock.
+#
+#     instrument.enable()
+#     ...
+#     instrument.snapshot()          # nested dict
+#     instrument.prometheusText()    # Prometheus text exposition format
+
+# upper bounds of the histogram buckets; each also has an implicit +Inf bucket
+LATENCY_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+                   1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BATCH_BUCKETS = tuple(4**k for k in range(13))
+
+# method name -> whether its input is a net income
+SCHEDULE_METHODS = {
+    "netIncome": False,
+    "netIncomeInverse": True,
+    "taxPaidGross": False,
+    "taxPaidNet": True,
+    "netIncomeArray": False,
+    "netIncomeInverseArray": True,
+    "taxPaidGrossArray": False,
+    "taxPaidNetArray": True,
+}
+LOOKUP_METHODS = ("netIncome", "taxPaidGross", "netIncomeArray", "taxPaidGrossArray")
+
+class _Recorder:
+    # one thread's counters
+
+    def __init__(self):
+        self.depth = 0
+        self.clear()
+
+    def clear(self):
+        # only ever called on the owning thread; reset() asks for it through reset_requested
+        self.reset_requested = False
+        self.calls = {}
+        self.errors = {}
+        self.latency = {}
+        self.latency_sum = {}
+        self.batches = {}
+        self.batch_sum = {}
+        self.bracket_hits = {}
+
+    def record(self, function, path, seconds, size, failed):
+        if self.reset_requested:
+            self.clear()
+        key = (function, path)
+        if key not in self.latency:
+            # every per-key entry exists before calls[key] does, so a snapshot
+            # taken from another thread never finds a call without its histograms
+            self.latency_sum[key] = 0.0
+            self.latency[key] = [0]*(len(LATENCY_BUCKETS) + 1)
+        if size is not None and key not in self.batches:
+            self.batch_sum[key] = 0
+            self.batches[key] = [0]*(len(BATCH_BUCKETS) + 1)
+        self.latency[key][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.latency_sum[key] += seconds
+        if size is not None:
+            self.batches[key][bisect_left(BATCH_BUCKETS, size)] += 1
+            self.batch_sum[key] += size
+        if failed:
+            self.errors[key] = self.errors.get(key, 0) + 1
+        self.calls[key] = self.calls.get(key, 0) + 1
+
+    def hit(self, schedule, brackets):
+        label = _label(schedule)
+        hits = self.bracket_hits.get(label)
+        if hits is None:
+            hits = self.bracket_hits[label] = np.zeros(len(schedule.uppers), dtype=np.int64)
+        if type(brackets) is int:
+            hits[brackets] += 1
+        else:
+            hits += np.bincount(brackets, minlength=len(hits))
+
+_local = threading.local()
+_recorders = []
+_recorders_lock = threading.Lock()
+_originals = {}
+_labels = {}
+
+def _recorder():
+    recorder = getattr(_local, "recorder", None)
+    if recorder is None:
+        recorder = _local.recorder = _Recorder()
+        # once per thread, not once per call
+        with _recorders_lock:
+            _recorders.append(recorder)
+    return recorder
+
+def _label(schedule):
+    # short fingerprint naming a schedule in the bracket-hit counts
+    label = _labels.get(schedule)
+    if label is None:
+        label = _labels[schedule] = schedule.fingerprint()[:12]
+    return label
+
+def _scalarBracket(schedule, value, net):
+    # bracket of a valid input; net incomes are placed against the net thresholds
+    if type(value) not in (int, float) and not isinstance(value, np.number) or value != value:
+        return None
+    if net:
+        return bisect_left(schedule.net_uppers, value) if value > 0 else None
+    return schedule.bracket(value) if value >= schedule.floor else None
+
+def _arrayBrackets(schedule, values, net):
+    values = np.asarray(values, dtype=float).reshape(-1)
+    if net:
+        return np.searchsorted(schedule.net_upper_array, values[values > 0])
+    return schedule.bracketArray(values[values >= schedule.floor])
+
+def _timed(method, name, path, net):
+    array = name.endswith("Array")
+    brackets = _arrayBrackets if array else _scalarBracket
+
+    @functools.wraps(method)
+    def wrapper(self, values, *args, **kwargs):
+        recorder = _recorder()
+        if recorder.depth:
+            return method(self, values, *args, **kwargs)
+        recorder.depth += 1
+        failed = True
+        start = time.perf_counter()
+        try:
+            result = method(self, values, *args, **kwargs)
+            failed = False
+            return result
+        finally:
+            seconds = time.perf_counter() - start
+            recorder.depth -= 1
+            recorder.record(name, path, seconds, int(np.size(values)) if array else None, failed)
+            schedule = self if isinstance(self, tax.TaxSchedule) else self.schedule
+            hits = brackets(schedule, values, net)
+            if hits is not None:
+                recorder.hit(schedule, hits)
+    return wrapper
+
+def enabled():
+    return bool(_originals)
+
+def enable():
+    if _originals:
+        return
+    for name, net in SCHEDULE_METHODS.items():
+        method = getattr(tax.TaxSchedule, name)
+        _originals[(tax.TaxSchedule, name)] = method
+        path = "vectorized" if name.endswith("Array") else "scalar"
+        setattr(tax.TaxSchedule, name, _timed(method, name, path, net))
+    for name in LOOKUP_METHODS:
+        method = getattr(lookup.LookupTable, name)
+        _originals[(lookup.LookupTable, name)] = method
+        setattr(lookup.LookupTable, name, _timed(method, name, "lookup", False))
+
+def disable():
+    for (cls, name), method in _originals.items():
+        setattr(cls, name, method)
+    _originals.clear()
+
+def reset():
+    # Threads keep their recorders, and each clears its own on its next call,
+    # so a reset never swaps counters out from under a thread that is recording.
+    # Until then the old counts are left out of snapshots.
+    with _recorders_lock:
+        recorders = list(_recorders)
+    for recorder in recorders:
+        recorder.reset_requested = True
+
+def _histogram(bounds, counts, total):
+    # cumulative counts per upper bound, as Prometheus reports them
+    cumulative = np.cumsum(counts).tolist()
+    return {"le": list(bounds) + [math.inf], "cumulative": cumulative, "count": cumulative[-1], "sum": total}
+
+def snapshot():
+    # Merged counts from every thread, keyed by function and then by path:
+    # calls, errors, a latency histogram and, for arrays, a batch-size histogram.
+    # bracket_hits maps each schedule's short fingerprint to per-bracket counts.
+    with _recorders_lock:
+        recorders = list(_recorders)
+    calls, errors, latency, latency_sum, batches, batch_sum, hits = {}, {}, {}, {}, {}, {}, {}
+    for recorder in recorders:
+        if recorder.reset_requested:
+            continue
+        # Other threads keep recording while this reads, so a key can be
+        # mid-way through being added; anything not complete yet is skipped.
+        for key, count in list(recorder.calls.items()):
+            counts = recorder.latency.get(key)
+            if counts is None:
+                continue
+            calls[key] = calls.get(key, 0) + count
+            errors[key] = errors.get(key, 0) + recorder.errors.get(key, 0)
+            latency[key] = latency.get(key, 0) + np.array(counts)
+            latency_sum[key] = latency_sum.get(key, 0.0) + recorder.latency_sum.get(key, 0.0)
+            sizes = recorder.batches.get(key)
+            if sizes is not None:
+                batches[key] = batches.get(key, 0) + np.array(sizes)
+                batch_sum[key] = batch_sum.get(key, 0) + recorder.batch_sum.get(key, 0)
+        for label, counts in list(recorder.bracket_hits.items()):
+            hits[label] = hits.get(label, 0) + counts
+
+    functions = {}
+    for function, path in sorted(calls):
+        key = (function, path)
+        stats = {
+            "calls": calls[key],
+            "errors": errors[key],
+            "latency_seconds": _histogram(LATENCY_BUCKETS, latency[key], latency_sum[key]),
+        }
+        if key in batches:
+            stats["batch_size"] = _histogram(BATCH_BUCKETS, batches[key], batch_sum[key])
+        functions.setdefault(function, {})[path] = stats
+    return {
+        "enabled": enabled(),
+        "functions": functions,
+        "bracket_hits": {label: counts.tolist() for label, counts in sorted(hits.items())},
+    }
+
+def _bound(value):
+    return "+Inf" if value == math.inf else f"{value:g}"
+
+def prometheusText(prefix="tax"):
+    stats = snapshot()
+    lines = []
+
+    def family(name, kind, description):
+        lines.append(f"# HELP {prefix}_{name} {description}")
+        lines.append(f"# TYPE {prefix}_{name} {kind}")
+
+    def histogram(name, labels, data):
+        for bound, count in zip(data["le"], data["cumulative"]):
+            lines.append(f'{prefix}_{name}_bucket{{{labels},le="{_bound(bound)}"}} {count}')
+        lines.append(f"{prefix}_{name}_sum{{{labels}}} {data['sum']:.9g}")
+        lines.append(f"{prefix}_{name}_count{{{labels}}} {data['count']}")
+
+    rows = [(function, path, data) for function, paths in stats["functions"].items() for path, data in paths.items()]
+    family("calls_total", "counter", "Calls by function and path (scalar, vectorized or lookup).")
+    for function, path, data in rows:
+        lines.append(f'{prefix}_calls_total{{function="{function}",path="{path}"}} {data["calls"]}')
+    family("errors_total", "counter", "Calls that raised.")
+    for function, path, data in rows:
+        lines.append(f'{prefix}_errors_total{{function="{function}",path="{path}"}} {data["errors"]}')
+    family("call_latency_seconds", "histogram", "Wall time per call.")
+    for function, path, data in rows:
+        histogram("call_latency_seconds", f'function="{function}",path="{path}"', data["latency_seconds"])
+    family("batch_size", "histogram", "Values per array call.")
+    for function, path, data in rows:
+        if "batch_size" in data:
+            histogram("batch_size", f'function="{function}",path="{path}"', data["batch_size"])
+    family("bracket_hits_total", "counter", "Inputs falling in each bracket, by schedule fingerprint.")
+    for label, counts in stats["bracket_hits"].items():
+        for bracket, count in enumerate(counts, start=1):
+            lines.append(f'{prefix}_bracket_hits_total{{schedule="{label}",bracket="{bracket}"}} {count}')
+    return "\n".join(lines) + "\n"
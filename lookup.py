@@ -0,0 +1,102 @@
+import os
+import struct
+
+import numpy as np
+
+import tax
+
+# Precomputed net income and tax for every whole dollar from 0 to a ceiling,
+# stored as cents in a flat binary file. Opening it memory-maps the file
+# read-only, so startup is near zero and every process on a host shares the
+# same pages. Fractional incomes, and incomes above the ceiling, fall back to
+# the computed path.
+#
+#     lookup.buildTable("table.bin", 2000000)
+#     table = lookup.LookupTable("table.bin")
+#     table.netIncomeArray(incomes)
+
+MAGIC = b"TAXLUT\x00\x01"
+# magic, cents item size in bytes, ceiling in dollars, sha256 of the schedule
+HEADER = struct.Struct("<8sIq32s")
+HEADER_SIZE = 64
+BUILD_CHUNK = 1000000
+
+def centsType(ceiling, schedule):
+    # int32 cents while the top value fits, which halves the file
+    top = max(ceiling, schedule.taxPaidGross(ceiling))
+    return np.dtype("<i4") if top*100 < np.iinfo(np.int32).max else np.dtype("<i8")
+
+def buildTable(path, ceiling, schedule=None):
+    schedule = tax.resolveSchedule(schedule)
+    ceiling = int(ceiling)
+    if ceiling < 0:
+        raise ValueError(f"ceiling must be non-negative, got {ceiling}")
+    dtype = centsType(ceiling, schedule)
+    count = ceiling + 1
+    header = HEADER.pack(MAGIC, dtype.itemsize, ceiling, bytes.fromhex(schedule.fingerprint()))
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(header.ljust(HEADER_SIZE, b"\0"))
+        f.truncate(HEADER_SIZE + 2*count*dtype.itemsize)
+    net = np.memmap(temporary, dtype=dtype, mode="r+", offset=HEADER_SIZE, shape=(count,))
+    paid = np.memmap(temporary, dtype=dtype, mode="r+", offset=HEADER_SIZE + count*dtype.itemsize, shape=(count,))
+    for start in range(0, count, BUILD_CHUNK):
+        incomes = np.arange(start, min(start + BUILD_CHUNK, count), dtype=float)
+        net[start:start + len(incomes)] = np.rint(schedule.netIncomeArray(incomes)*100)
+        paid[start:start + len(incomes)] = np.rint(schedule.taxPaidGrossArray(incomes)*100)
+    net.flush()
+    paid.flush()
+    del net, paid
+    # readers never see a half-written table
+    os.replace(temporary, path)
+    return path
+
+class LookupTable:
+
+    def __init__(self, path, schedule=None):
+        self.schedule = tax.resolveSchedule(schedule)
+        with open(path, "rb") as f:
+            magic, itemsize, ceiling, digest = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a tax lookup table")
+        if digest.hex() != self.schedule.fingerprint():
+            raise ValueError(f"{path} was built for a different tax schedule")
+        self.path = path
+        self.ceiling = ceiling
+        dtype = np.dtype("<i4") if itemsize == 4 else np.dtype("<i8")
+        count = ceiling + 1
+        self.net_cents = np.memmap(path, dtype=dtype, mode="r", offset=HEADER_SIZE, shape=(count,))
+        self.tax_cents = np.memmap(path, dtype=dtype, mode="r", offset=HEADER_SIZE + count*itemsize, shape=(count,))
+
+    def covers(self, income):
+        return 0 <= income <= self.ceiling and income == int(income)
+
+    def netIncome(self, income):
+        if self.covers(income):
+            return int(self.net_cents[int(income)])/100
+        return self.schedule.netIncome(income)
+
+    def taxPaidGross(self, income):
+        if self.covers(income):
+            return int(self.tax_cents[int(income)])/100
+        return self.schedule.taxPaidGross(income)
+
+    def _lookupArray(self, incomes, cents, fallback):
+        incomes = np.asarray(incomes, dtype=float)
+        covered = (incomes >= 0) & (incomes <= self.ceiling) & (incomes == np.floor(incomes))
+        if covered.all():
+            return cents[incomes.astype(np.int64)]/100
+        results = np.empty(incomes.shape)
+        results[covered] = cents[incomes[covered].astype(np.int64)]/100
+        results[~covered] = fallback(incomes[~covered])
+        return results
+
+    def netIncomeArray(self, incomes):
+        return self._lookupArray(incomes, self.net_cents, self.schedule.netIncomeArray)
+
+    def taxPaidGrossArray(self, incomes):
+        return self._lookupArray(incomes, self.tax_cents, self.schedule.taxPaidGrossArray)
+
+def run(args):
+    buildTable(args.output, args.ceiling, args.schedule)
+    print(f"Wrote {args.output} for incomes up to ${args.ceiling:,}")
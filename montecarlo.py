@@ -0,0 +1,166 @@
+import functools
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import tax
+
+# Monte Carlo over synthetic populations. Incomes are drawn in fixed-size
+# chunks, chunk i from its own seed (seed, i), so a chunk's draws depend only
+# on the seed and its index, never on which process drew it or in what order.
+# Each chunk is taxed in one array call and folded into a SimulationSummary:
+# sums and counts plus log-bucketed quantile sketches, all of which merge
+# exactly. Memory is one chunk plus the sketches, however many draws.
+#
+#     sampler = montecarlo.lognormal(mu=11.0, sigma=0.7)
+#     summary = montecarlo.simulate(sampler, 50_000_000, seed=7, workers=8)
+#     summary.result()["income_quantiles"]
+
+DEFAULT_CHUNK_SIZE = 1000000
+DEFAULT_ACCURACY = 0.005
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9, 0.99)
+# the sketch spans 1 to 1e15 dollars; values below a dollar share one bucket at zero
+SKETCH_TOP = 1e15
+
+def _lognormal(rng, size, mu, sigma):
+    return rng.lognormal(mu, sigma, size)
+
+def lognormal(mu, sigma):
+    # incomes whose logs are normal with mean mu and standard deviation sigma
+    return functools.partial(_lognormal, mu=mu, sigma=sigma)
+
+def chunkRng(seed, index):
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(index,)))
+
+class QuantileSketch:
+    # Counts in geometric buckets: bucket k >= 1 holds (gamma**(k-2), gamma**(k-1)]
+    # and bucket 0 everything below a dollar. The value reported for a bucket is
+    # within accuracy, relative, of every value in it. Counts are integers, so
+    # merging is exact and order-free.
+
+    def __init__(self, accuracy=DEFAULT_ACCURACY):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy)/(1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.counts = np.zeros(math.ceil(math.log(SKETCH_TOP)/self.log_gamma) + 2, dtype=np.int64)
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float).reshape(-1)
+        values = values[~np.isnan(values)]
+        keys = np.zeros(len(values), dtype=np.int64)
+        above = values >= 1
+        keys[above] = np.ceil(np.log(values[above])/self.log_gamma).astype(np.int64) + 1
+        np.minimum(keys, len(self.counts) - 1, out=keys)
+        self.counts += np.bincount(keys, minlength=len(self.counts))
+        return self
+
+    def merge(self, other):
+        if other.accuracy != self.accuracy:
+            raise ValueError("sketches must share an accuracy to merge")
+        merged = QuantileSketch(self.accuracy)
+        merged.counts = self.counts + other.counts
+        return merged
+
+    def count(self):
+        return int(self.counts.sum())
+
+    def quantiles(self, qs):
+        # value at each quantile, within the sketch's relative accuracy
+        qs = np.asarray(qs, dtype=float)
+        if np.any((qs < 0) | (qs > 1)):
+            raise ValueError("quantiles must lie in [0, 1]")
+        total = self.count()
+        if total == 0:
+            return np.full(qs.shape, np.nan)
+        ranks = np.floor(qs*(total - 1))
+        keys = np.searchsorted(np.cumsum(self.counts), ranks, side="right")
+        # the middle of bucket k, relative to its ends
+        values = 2*self.gamma**(keys - 1)/(1 + self.gamma)
+        return np.where(keys == 0, 0.0, values)
+
+class SimulationSummary:
+
+    def __init__(self, brackets, accuracy=DEFAULT_ACCURACY):
+        self.draws = 0
+        self.revenue = 0.0
+        self.total_income = 0.0
+        self.bracket_counts = np.zeros(brackets, dtype=np.int64)
+        self.income_sketch = QuantileSketch(accuracy)
+        self.tax_sketch = QuantileSketch(accuracy)
+
+    def add(self, incomes, taxes, brackets):
+        self.draws += len(incomes)
+        self.revenue += float(taxes.sum())
+        self.total_income += float(incomes.sum())
+        self.bracket_counts += np.bincount(brackets, minlength=len(self.bracket_counts))
+        self.income_sketch.add(incomes)
+        self.tax_sketch.add(taxes)
+        return self
+
+    def merge(self, other):
+        # float sums depend on order, so merge summaries in chunk order for identical results
+        merged = SimulationSummary(len(self.bracket_counts), self.income_sketch.accuracy)
+        merged.draws = self.draws + other.draws
+        merged.revenue = self.revenue + other.revenue
+        merged.total_income = self.total_income + other.total_income
+        merged.bracket_counts = self.bracket_counts + other.bracket_counts
+        merged.income_sketch = self.income_sketch.merge(other.income_sketch)
+        merged.tax_sketch = self.tax_sketch.merge(other.tax_sketch)
+        return merged
+
+    def result(self, quantiles=QUANTILES):
+        return {
+            "draws": self.draws,
+            "revenue": self.revenue,
+            "total_income": self.total_income,
+            "mean_tax": self.revenue/self.draws if self.draws else math.nan,
+            "average_rate": self.revenue/self.total_income if self.total_income else math.nan,
+            "bracket_shares": self.bracket_counts/self.draws if self.draws else self.bracket_counts*0.0,
+            "quantiles": np.asarray(quantiles, dtype=float),
+            "income_quantiles": self.income_sketch.quantiles(quantiles),
+            "tax_quantiles": self.tax_sketch.quantiles(quantiles),
+        }
+
+def simulateChunk(sampler, seed, index, size, schedule, accuracy=DEFAULT_ACCURACY):
+    # draws and summarises chunk index; the same arguments give the same summary anywhere
+    incomes = np.asarray(sampler(chunkRng(seed, index), size), dtype=float)
+    if incomes.size and incomes.min() < schedule.floor:
+        raise ValueError(f"sampled incomes must be at least {schedule.floor}")
+    summary = SimulationSummary(len(schedule.uppers), accuracy)
+    return summary.add(incomes, schedule.taxPaidGrossArray(incomes), schedule.bracketArray(incomes))
+
+def _chunkSizes(draws, chunk_size):
+    for index, start in enumerate(range(0, draws, chunk_size)):
+        yield index, min(chunk_size, draws - start)
+
+def chunkSummaries(sampler, draws, seed=0, chunk_size=DEFAULT_CHUNK_SIZE, schedule=None,
+                   accuracy=DEFAULT_ACCURACY, workers=1):
+    # Yields one SimulationSummary per chunk, in chunk order. With workers > 1
+    # the chunks run in a process pool, at most 2*workers of them at a time.
+    schedule = tax.resolveSchedule(schedule)
+    chunks = _chunkSizes(int(draws), int(chunk_size))
+    if workers <= 1:
+        for index, size in chunks:
+            yield simulateChunk(sampler, seed, index, size, schedule, accuracy)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        for index, size in chunks:
+            pending.append(pool.submit(simulateChunk, sampler, seed, index, size, schedule, accuracy))
+            if len(pending) >= 2*workers:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+def simulate(sampler, draws, seed=0, chunk_size=DEFAULT_CHUNK_SIZE, schedule=None,
+             accuracy=DEFAULT_ACCURACY, workers=1):
+    # Every chunk summary folded together in chunk order. The result depends
+    # on the seed and chunk_size only, not on workers.
+    schedule = tax.resolveSchedule(schedule)
+    summary = SimulationSummary(len(schedule.uppers), accuracy)
+    for chunk in chunkSummaries(sampler, draws, seed, chunk_size, schedule, accuracy,
+                                workers if workers else os.cpu_count() or 1):
+        summary = summary.merge(chunk)
+    return summary
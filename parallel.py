@@ -0,0 +1,114 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import tax
+
+# public batch path -> TaxSchedule method evaluated in the workers
+BATCH_METHODS = {
+    "netIncome": "netIncomeArray",
+    "netIncomeInverse": "netIncomeInverseArray",
+    "taxPaidGross": "taxPaidGrossArray",
+    "taxPaidNet": "taxPaidNetArray",
+}
+
+# below this many values a pool costs more than it saves
+MIN_PARALLEL_SIZE = 200000
+
+_worker_schedule = None
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before Python 3.13 attaching re-registers the segment with the parent's
+        # resource tracker, which already holds it, so this is harmless
+        return shared_memory.SharedMemory(name=name)
+
+def _initWorker(schedule):
+    # the compiled schedule is pickled once per worker, not once per task
+    global _worker_schedule
+    _worker_schedule = schedule
+
+def _runSlice(method, in_name, out_name, size, start, stop):
+    in_block = _attach(in_name)
+    out_block = _attach(out_name)
+    try:
+        values = np.ndarray(size, dtype=np.float64, buffer=in_block.buf)
+        results = np.ndarray(size, dtype=np.float64, buffer=out_block.buf)
+        results[start:stop] = getattr(_worker_schedule, method)(values[start:stop])
+        del values, results
+    finally:
+        in_block.close()
+        out_block.close()
+    return stop - start
+
+class ParallelEngine:
+    # A process pool for the batch paths. Inputs and outputs move through
+    # shared memory, so only slice bounds are pickled per task.
+    #
+    #     with ParallelEngine(workers=8) as engine:
+    #         net = engine.map("netIncome", incomes)
+
+    def __init__(self, schedule=None, workers=None, min_size=MIN_PARALLEL_SIZE):
+        self.schedule = tax.resolveSchedule(schedule)
+        self.workers = workers or os.cpu_count() or 1
+        self.min_size = min_size
+        self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def _pool(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_initWorker, initargs=(self.schedule,)
+            )
+        return self.pool
+
+    def map(self, function, values):
+        if function not in BATCH_METHODS:
+            raise ValueError(f"function must be one of {sorted(BATCH_METHODS)}, got {function!r}")
+        method = BATCH_METHODS[function]
+        values = np.ascontiguousarray(values, dtype=np.float64)
+        shape = values.shape
+        values = values.reshape(-1)
+        size = values.size
+        if self.workers <= 1 or size < self.min_size:
+            return getattr(self.schedule, method)(values).reshape(shape)
+
+        in_block = shared_memory.SharedMemory(create=True, size=values.nbytes)
+        out_block = shared_memory.SharedMemory(create=True, size=values.nbytes)
+        try:
+            shared_in = np.ndarray(size, dtype=np.float64, buffer=in_block.buf)
+            shared_in[:] = values
+            step = -(-size // self.workers)
+            futures = [
+                self._pool().submit(_runSlice, method, in_block.name, out_block.name, size, start, min(start + step, size))
+                for start in range(0, size, step)
+            ]
+            for future in futures:
+                future.result()
+            results = np.ndarray(size, dtype=np.float64, buffer=out_block.buf).copy()
+            del shared_in
+        finally:
+            in_block.close()
+            in_block.unlink()
+            out_block.close()
+            out_block.unlink()
+        return results.reshape(shape)
+
+def parallelMap(function, values, schedule=None, workers=None):
+    # one-off parallel evaluation; use ParallelEngine to keep the pool between calls
+    with ParallelEngine(schedule, workers) as engine:
+        return engine.map(function, values)
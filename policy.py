@@ -0,0 +1,106 @@
+import math
+
+import numpy as np
+
+import tax
+
+# Costing many candidate schedules against one population. The population is
+# sorted once, with prefix sums of weight and weighted income. A bracket's tax
+# over everyone inside it then comes from the prefix sums at its two threshold
+# positions, so each candidate costs O(brackets) after one search per distinct
+# threshold. Threshold positions are cached, so candidates that share
+# thresholds, and what-if edits that move one threshold, only search for
+# what is new.
+#
+#     costing = policy.PolicyCosting(incomes)
+#     stats = costing.evaluate(candidates)
+#     costing.whatIf("2023-24", thresholds={2: 50000})
+
+DECILES = 10
+
+def _asSchedule(candidate):
+    if isinstance(candidate, tuple):
+        return tax.TaxSchedule(*candidate)
+    return tax.resolveSchedule(candidate)
+
+class PolicyCosting:
+
+    def __init__(self, incomes, weights=None, groups=DECILES):
+        incomes = np.asarray(incomes, dtype=float).reshape(-1)
+        weights = np.ones_like(incomes) if weights is None else np.asarray(weights, dtype=float).reshape(-1)
+        if weights.shape != incomes.shape:
+            raise ValueError("weights must match incomes")
+        order = np.argsort(incomes, kind="stable")
+        self.incomes = incomes[order]
+        self.weights = weights[order]
+        self.cumulative_weight = np.concatenate([[0.0], np.cumsum(self.weights)])
+        self.cumulative_income = np.concatenate([[0.0], np.cumsum(self.weights*self.incomes)])
+        self.total_weight = self.cumulative_weight[-1]
+        self.total_income = self.cumulative_income[-1]
+        # income groups of equal weight (deciles by default), as sorted positions
+        targets = self.total_weight*np.arange(groups + 1)/groups
+        self.cuts = np.searchsorted(self.cumulative_weight, targets)
+        self.cuts[0], self.cuts[-1] = 0, len(self.incomes)
+        self.positions = {}
+
+    def _positions(self, thresholds):
+        # number of incomes at or below each threshold, searching only unseen values
+        unique, inverse = np.unique(thresholds, return_inverse=True)
+        missing = [value for value in unique.tolist() if value not in self.positions]
+        if missing:
+            found = np.searchsorted(self.incomes, missing, side="right")
+            self.positions.update(zip(missing, found.tolist()))
+        found = np.array([self.positions[value] for value in unique.tolist()], dtype=np.int64)
+        return found[inverse].reshape(np.shape(thresholds))
+
+    def _stack(self, schedules):
+        # pad every schedule to the same bracket count with empty brackets
+        width = max(len(schedule.uppers) for schedule in schedules)
+        lowers = np.full((len(schedules), width), math.inf)
+        uppers = np.full((len(schedules), width), math.inf)
+        rates = np.zeros((len(schedules), width))
+        tax_at = np.zeros((len(schedules), width))
+        for row, schedule in enumerate(schedules):
+            k = len(schedule.uppers)
+            lowers[row, :k] = schedule.lowers
+            uppers[row, :k] = schedule.uppers
+            rates[row, :k] = schedule.rates
+            tax_at[row, :k] = schedule.tax_at
+        return lowers, uppers, rates, tax_at
+
+    def _cumulativeTax(self, lowers, uppers, rates, tax_at):
+        # tax paid by the first i sorted people, for i at each group cut
+        start = self._positions(lowers)
+        stop = self._positions(uppers)
+        cuts = self.cuts[None, None, :]
+        low = np.clip(cuts, start[..., None], stop[..., None])
+        weight = self.cumulative_weight[low] - self.cumulative_weight[start][..., None]
+        income = self.cumulative_income[low] - self.cumulative_income[start][..., None]
+        finite_lowers = np.where(np.isfinite(lowers), lowers, 0)[..., None]
+        per_bracket = tax_at[..., None]*weight + rates[..., None]*(income - finite_lowers*weight)
+        return per_bracket.sum(axis=1)
+
+    def evaluate(self, candidates):
+        # Candidates are TaxSchedules, registered names or (brackets, rates)
+        # pairs. Returns arrays with one row per candidate.
+        schedules = [_asSchedule(candidate) for candidate in candidates]
+        cumulative = self._cumulativeTax(*self._stack(schedules))
+        revenue = cumulative[:, -1]
+        group_revenue = np.diff(cumulative, axis=1)
+        group_income = np.diff(self.cumulative_income[self.cuts])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return {
+                "revenue": revenue,
+                "average_rate": revenue/self.total_income if self.total_income else np.zeros_like(revenue),
+                "group_revenue": group_revenue,
+                "group_share": group_revenue/revenue[:, None],
+                "group_average_rate": group_revenue/group_income[None, :],
+            }
+
+    def whatIf(self, schedule, thresholds=None, rates=None):
+        # re-cost one schedule with some thresholds or rates changed, keyed as in tax_brackets/tax_rates
+        brackets, schedule_rates = _asSchedule(schedule).definition()
+        brackets.update(thresholds or {})
+        schedule_rates.update(rates or {})
+        stats = self.evaluate([(brackets, schedule_rates)])
+        return {key: value[0] for key, value in stats.items()}
@@ -0,0 +1,165 @@
+import csv
+import math
+
+import numpy as np
+
+import batch
+import tax
+
+# Binned populations. An IncomeHistogram holds, for each income bin, the
+# number of people (or their total weight) and, optionally, their total
+# income. Tax is piecewise linear, so integrating it over a bin needs only
+# those two figures:
+#
+#  * a bin inside a single bracket with a known total income is exact;
+#  * a bin straddling a threshold is bounded by the least and most tax any
+#    distribution with that count and mean could pay, from the convex
+#    envelopes of the tax over the bin.
+#
+# An aggregate therefore costs O(bins + brackets), not O(people).
+#
+#     histogram = population.IncomeHistogram.fromFile("payroll.csv", np.arange(0, 2000001, 1000))
+#     histogram.revenue("2023-24")    # estimate, lower, upper, error_bound
+
+def defaultEdges(width=1000, top=2000000):
+    # whole-dollar bins up to top, then one open-ended bin
+    return np.append(np.arange(0, top + width, width, dtype=float), math.inf)
+
+def _envelope(xs, ys, mean, tail_slope, lowest):
+    # Least (lowest=True) or most tax at the given mean over distributions
+    # supported on points xs. The last x may be inf, reached through tail_slope.
+    best = None
+    for i, (x0, y0) in enumerate(zip(xs, ys)):
+        if x0 > mean:
+            break
+        if x0 == mean:
+            candidates = [y0]
+        else:
+            candidates = []
+            for x1, y1 in zip(xs[i + 1:], ys[i + 1:]):
+                if x1 < mean:
+                    continue
+                if x1 == math.inf:
+                    candidates.append(y0 + tail_slope*(mean - x0))
+                else:
+                    candidates.append(y0 + (y1 - y0)*(mean - x0)/(x1 - x0))
+        for value in candidates:
+            if best is None or (value < best if lowest else value > best):
+                best = value
+    return best
+
+class IncomeHistogram:
+
+    def __init__(self, edges, counts=None, sums=None):
+        self.edges = np.asarray(edges, dtype=float)
+        if self.edges.ndim != 1 or len(self.edges) < 2 or np.any(np.diff(self.edges) <= 0):
+            raise ValueError("edges must be increasing, with at least one bin")
+        bins = len(self.edges) - 1
+        self.counts = np.zeros(bins) if counts is None else np.asarray(counts, dtype=float)
+        # total income per bin, or None when only counts are known
+        self.sums = None if sums is None and counts is not None else (
+            np.zeros(bins) if sums is None else np.asarray(sums, dtype=float))
+        if self.counts.shape != (bins,) or (self.sums is not None and self.sums.shape != (bins,)):
+            raise ValueError("counts and sums need one entry per bin")
+
+    @classmethod
+    def fromArray(cls, incomes, edges, weights=None):
+        histogram = cls(edges)
+        histogram.add(incomes, weights)
+        return histogram
+
+    @classmethod
+    def fromQuantiles(cls, quantiles, population):
+        # quantiles[0] < ... < quantiles[-1] splitting population into equal-weight bins
+        bins = len(quantiles) - 1
+        return cls(quantiles, np.full(bins, population/bins))
+
+    @classmethod
+    def fromFile(cls, path, edges, column="income", chunk_size=batch.DEFAULT_CHUNK_SIZE, delimiter=None):
+        # one streaming pass; memory is one chunk plus the bins
+        histogram = cls(edges)
+        with open(path, newline="") as f:
+            reader = csv.reader(f, delimiter=delimiter or batch.guessDelimiter(path))
+            header = next(reader, None)
+            if header is None:
+                raise ValueError(f"{path} is empty")
+            index = batch.columnIndex(header, column)
+            for _, values in batch.readChunks(reader, index, chunk_size):
+                histogram.add(values[~np.isnan(values)])
+        return histogram
+
+    def add(self, incomes, weights=None):
+        if self.sums is None:
+            raise ValueError("a histogram built from counts alone cannot take individual incomes")
+        incomes = np.asarray(incomes, dtype=float).reshape(-1)
+        weights = np.ones_like(incomes) if weights is None else np.asarray(weights, dtype=float).reshape(-1)
+        if incomes.size and (incomes.min() < self.edges[0] or incomes.max() >= self.edges[-1]):
+            raise ValueError(f"incomes must lie in [{self.edges[0]}, {self.edges[-1]})")
+        j = np.searchsorted(self.edges, incomes, side="right") - 1
+        self.counts += np.bincount(j, weights, minlength=len(self.counts))
+        self.sums += np.bincount(j, weights*incomes, minlength=len(self.counts))
+        return self
+
+    def merge(self, other):
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("histograms must share edges to merge")
+        sums = None if self.sums is None or other.sums is None else self.sums + other.sums
+        return IncomeHistogram(self.edges, self.counts + other.counts, sums)
+
+    def revenue(self, schedule=None):
+        # Total unrounded tax, as an estimate with guaranteed lower and upper
+        # bounds. Bins with a known total income inside one bracket are exact.
+        schedule = tax.resolveSchedule(schedule)
+        lows, highs = self.edges[:-1], self.edges[1:]
+        occupied = self.counts > 0
+        thresholds = np.array([upper for upper in schedule.uppers if upper != math.inf])
+        straddles = np.searchsorted(thresholds, lows, side="right") < np.searchsorted(thresholds, highs, side="left")
+        tail_slope = schedule.rates[-1]
+
+        lower = np.zeros(len(self.counts))
+        upper = np.zeros(len(self.counts))
+        estimate = np.zeros(len(self.counts))
+        simple = occupied & ~straddles
+        if self.sums is None and occupied[-1] and highs[-1] == math.inf:
+            raise ValueError("an occupied open-ended bin needs its total income to be bounded")
+        if self.sums is not None:
+            # tax is linear across each of these bins, so count*tax(mean) is exact
+            means = self.sums[simple]/self.counts[simple]
+            exact = self.counts[simple]*schedule.taxArray(means)
+            lower[simple] = upper[simple] = estimate[simple] = exact
+        else:
+            at_low = schedule.taxArray(lows[simple])
+            at_high = schedule.taxArray(highs[simple])
+            lower[simple] = self.counts[simple]*np.minimum(at_low, at_high)
+            upper[simple] = self.counts[simple]*np.maximum(at_low, at_high)
+            # incomes spread evenly across the bin
+            estimate[simple] = self.counts[simple]*(at_low + at_high)/2
+
+        for i in np.flatnonzero(occupied & straddles):
+            a, b = lows[i], highs[i]
+            inside = thresholds[(thresholds > a) & (thresholds < b)]
+            xs = [a] + inside.tolist() + [b]
+            finite = [x for x in xs if x != math.inf]
+            ys = schedule.taxArray(finite).tolist() + ([math.inf] if b == math.inf else [])
+            count = self.counts[i]
+            if self.sums is not None:
+                mean = self.sums[i]/count
+                lower[i] = count*_envelope(xs, ys, mean, tail_slope, True)
+                upper[i] = count*_envelope(xs, ys, mean, tail_slope, False)
+                estimate[i] = (lower[i] + upper[i])/2
+            else:
+                lower[i] = count*min(ys)
+                upper[i] = count*max(ys)
+                # incomes spread evenly: the trapezoid rule is exact on each linear piece
+                area = sum((y0 + y1)*(x1 - x0)/2 for x0, x1, y0, y1 in zip(xs, xs[1:], ys, ys[1:]))
+                estimate[i] = count*area/(b - a)
+
+        estimate = estimate.sum()
+        lower = lower.sum()
+        upper = upper.sum()
+        return {
+            "estimate": estimate,
+            "lower": lower,
+            "upper": upper,
+            "error_bound": max(upper - estimate, estimate - lower),
+        }
@@ -0,0 +1,266 @@
+import asyncio
+import json
+import math
+import time
+from collections import deque
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+import instrument
+import tax
+
+# A small asyncio HTTP service over the array paths. Requests that arrive
+# within max_latency of each other are evaluated together in one call.
+#
+#     GET /net?income=51389                 gross income -> net income
+#     GET /gross?net=44220.57               net income -> gross income
+#     GET /tax?amount=51389&basis=gross     tax paid
+#     GET /metrics                          latency and batch-size figures
+#     GET /metrics?format=prometheus        the same as Prometheus text, with
+#                                           the instrument counters when enabled
+#
+# Each calculation also takes schedule=2019-20, and POST accepts the same
+# fields as a JSON body.
+
+DEFAULT_MAX_BATCH_SIZE = 1024
+DEFAULT_MAX_LATENCY = 0.002
+LATENCY_WINDOW = 10000
+
+ROUTES = {
+    "/net": ("income", lambda schedule, basis: schedule.netIncomeArray),
+    "/gross": ("net", lambda schedule, basis: schedule.netIncomeInverseArray),
+    "/tax": ("amount", lambda schedule, basis: schedule.taxPaidGrossArray if basis == "gross" else schedule.taxPaidNetArray),
+}
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+class ServiceMetrics:
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.batches = 0
+        self.batched_values = 0
+        self.max_batch_size = 0
+
+    def recordRequest(self, seconds):
+        self.requests += 1
+        self.latencies.append(seconds)
+
+    def recordBatch(self, size):
+        self.batches += 1
+        self.batched_values += size
+        self.max_batch_size = max(self.max_batch_size, size)
+
+    def snapshot(self):
+        # latency percentiles are over the most recent window of requests
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        return {
+            "requests": self.requests,
+            "latency_p50_ms": float(np.percentile(latencies, 50))*1000,
+            "latency_p99_ms": float(np.percentile(latencies, 99))*1000,
+            "batches": self.batches,
+            "mean_batch_size": self.batched_values/self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+        }
+
+class MicroBatcher:
+    # Collects values submitted within max_latency of the first pending one,
+    # or until max_batch_size are waiting, then evaluates them in one array call.
+
+    def __init__(self, evaluate, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 max_latency=DEFAULT_MAX_LATENCY, metrics=None):
+        self.evaluate = evaluate
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.metrics = metrics
+        self.values = []
+        self.futures = []
+        self.timer = None
+
+    def submit(self, value):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.values.append(value)
+        self.futures.append(future)
+        if len(self.values) >= self.max_batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.max_latency, self.flush)
+        return future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        values, futures = self.values, self.futures
+        self.values, self.futures = [], []
+        if not values:
+            return
+        if self.metrics is not None:
+            self.metrics.recordBatch(len(values))
+        try:
+            results = self.evaluate(np.array(values, dtype=float)).tolist()
+        except Exception as error:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
+
+class TaxService:
+
+    def __init__(self, host="127.0.0.1", port=8000, max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 max_latency=DEFAULT_MAX_LATENCY):
+        self.host = host
+        self.port = port
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.metrics = ServiceMetrics()
+        self.batchers = {}
+        self.server = None
+
+    def batcher(self, path, schedule_name, basis):
+        key = (path, schedule_name, basis)
+        if key not in self.batchers:
+            schedule = tax.resolveSchedule(schedule_name)
+            evaluate = ROUTES[path][1](schedule, basis)
+            self.batchers[key] = MicroBatcher(evaluate, self.max_batch_size, self.max_latency, self.metrics)
+        return self.batchers[key]
+
+    async def calculate(self, path, params):
+        field = ROUTES[path][0]
+        if field not in params:
+            return 400, {"error": f"missing parameter {field!r}"}
+        try:
+            value = float(params[field])
+        except (TypeError, ValueError):
+            return 400, {"error": f"{field} must be a number"}
+        # inf and nan have no JSON form
+        if not math.isfinite(value):
+            return 400, {"error": f"{field} must be finite"}
+        basis = params.get("basis", "gross")
+        if basis not in ("gross", "net"):
+            return 400, {"error": "basis must be 'gross' or 'net'"}
+        schedule = params.get("schedule")
+        if schedule is not None and not isinstance(schedule, str):
+            return 400, {"error": "schedule must be a string such as '2019-20'"}
+        try:
+            batcher = self.batcher(path, schedule, basis)
+        except KeyError as error:
+            return 400, {"error": error.args[0]}
+        result = await batcher.submit(value)
+        if not math.isfinite(result):
+            return 400, {"error": f"{field} out of range"}
+        return 200, {field: value, "result": result}
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        if url.path == "/metrics":
+            metrics = self.metrics.snapshot()
+            if parse_qs(url.query).get("format", [""])[-1] == "prometheus":
+                service = "".join(f"tax_service_{name} {value}\n" for name, value in metrics.items())
+                return 200, service + (instrument.prometheusText() if instrument.enabled() else "")
+            if instrument.enabled():
+                metrics["instrumentation"] = instrument.snapshot()
+            return 200, metrics
+        if url.path not in ROUTES:
+            return 404, {"error": f"no route {url.path}"}
+        if method == "GET":
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        elif method == "POST":
+            try:
+                params = json.loads(body or b"{}")
+            except ValueError:
+                return 400, {"error": "body must be JSON"}
+            if not isinstance(params, dict):
+                return 400, {"error": "body must be a JSON object"}
+        else:
+            return 405, {"error": f"method {method} not allowed"}
+        return await self.calculate(url.path, params)
+
+    async def handle(self, reader, writer):
+        # HTTP/1.1 with keep-alive; one request at a time per connection
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                start = time.perf_counter()
+                parts = request_line.decode("latin-1").split()
+                if len(parts) != 3:
+                    break
+                method, target, version = parts
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                try:
+                    length = int(headers.get("content-length", 0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    # without a usable length the body can't be skipped, so the connection ends here
+                    status, payload = 400, {"error": "Content-Length must be a non-negative integer"}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    try:
+                        status, payload = await self.dispatch(method, target, body)
+                    except Exception as error:
+                        status, payload = 500, {"error": str(error)}
+                if isinstance(payload, str):
+                    content, content_type = payload.encode(), "text/plain; version=0.0.4"
+                else:
+                    content, content_type = json.dumps(payload).encode(), "application/json"
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(content)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + content
+                )
+                await writer.drain()
+                if urlsplit(target).path != "/metrics":
+                    self.metrics.recordRequest(time.perf_counter() - start)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        # port 0 asks the OS for a free port; report the one we got
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        for batcher in self.batchers.values():
+            batcher.flush()
+
+    async def serveForever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+def run(args):
+    if args.instrument:
+        instrument.enable()
+    service = TaxService(args.host, args.port, args.max_batch_size, args.max_latency_ms/1000)
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(service.serveForever())
+    except KeyboardInterrupt:
+        pass
@@ -1,73 +1,669 @@
+import argparse
+import datetime
+import hashlib
 import math
+from bisect import bisect_left
+from collections import namedtuple
+from functools import lru_cache
+from types import MappingProxyType
 
-tax_brackets = {
+import numpy as np
+
+# Read-only views of the default schedule's definition. To change the default,
+# build a new TaxSchedule and pass it to setDefaultSchedule.
+tax_brackets = MappingProxyType({
     0: 0,
     1: 18200,
     2: 45000,
     3: 120000,
     4: 180000,
     5: math.inf
-}
+})
 
-tax_rates = {
+tax_rates = MappingProxyType({
     1: 0,
     2: 0.19,
     3: 0.325,
     4: 0.37,
     5: 0.45
+})
+
+def _cents(values):
+    # values*100 rounded half-even, computed from the exact binary value of each
+    # entry rather than from the rounded product. np.round scales by 100 first,
+    # which can land on the wrong side of a half cent.
+    values = np.asarray(values, dtype=float)
+    # non-finite entries make nan/inf in the split below; callers pass them through
+    with np.errstate(invalid="ignore", over="ignore"):
+        scaled = values*100
+        cents = np.rint(scaled)
+        # exact error of the scaling (Dekker product, 100 splits exactly)
+        split = 134217729.0*values
+        high = split - (split - values)
+        low = values - high
+        error = (high*100 - scaled) + low*100
+        half = scaled - cents
+        cents = np.where((half == 0.5) & (error > 0), cents + 1, cents)
+        cents = np.where((half == -0.5) & (error < 0), cents - 1, cents)
+    return cents
+
+def _roundCents(values):
+    # round(value, 2) elementwise, matching Python's correctly rounded result
+    values = np.asarray(values, dtype=float)
+    # from 2**52 up every float is a whole number, so rounding leaves it as is
+    return np.where(np.abs(values) < 2.0**52, _cents(values)/100, values)
+
+# On (lower, upper] net income is marginal*income + intercept, so the average
+# return is marginal + intercept/income and the premium is
+# 100*intercept/(marginal*income + intercept).
+CurveSegment = namedtuple("CurveSegment", ["lower", "upper", "marginal", "intercept"])
+
+# most targets x brackets cells a target solver holds at once
+SOLVE_BLOCK = 2**20
+
+def _frozenArray(values):
+    array = np.array(values, dtype=float)
+    array.setflags(write=False)
+    return array
+
+class TaxSchedule:
+    # Bracket i covers incomes in (brackets[i-1], brackets[i]] and is taxed at rates[i].
+    # Everything that depends only on the schedule is worked out once here, so a
+    # lookup is a single binary search plus one multiply-add. Schedules are frozen
+    # once built and compare and hash by value, so one instance can be shared by
+    # any number of threads with no locking.
+
+    def __init__(self, brackets, rates):
+        indices = sorted(brackets)
+        self.floor = brackets[indices[0]]
+        self.lowers = [brackets[i - 1] for i in indices[1:]]
+        self.uppers = [brackets[i] for i in indices[1:]]
+        self.rates = [rates[i] for i in indices[1:]]
+        self.keeps = [1 - rate for rate in self.rates]
+        # incomes up to here are returned untouched by netIncome
+        self.tax_free = self.uppers[0] if self.rates[0] == 0 else self.floor
+
+        # net income and tax accumulated up to the lower threshold of each bracket
+        self.net_at = []
+        self.tax_at = []
+        net = 0
+        tax = 0
+        for lower, upper, rate, keep in zip(self.lowers, self.uppers, self.rates, self.keeps):
+            self.net_at.append(net)
+            self.tax_at.append(tax)
+            net += keep*(upper - lower)
+            tax += rate*(upper - lower)
+        self.net_uppers = self.net_at[1:] + [net]
+
+        for name in ("lowers", "uppers", "rates", "keeps", "net_at", "tax_at", "net_uppers"):
+            setattr(self, name, tuple(getattr(self, name)))
+        self.lower_array = _frozenArray(self.lowers)
+        self.upper_array = _frozenArray(self.uppers)
+        self.keep_array = _frozenArray(self.keeps)
+        self.rate_array = _frozenArray(self.rates)
+        self.tax_at_array = _frozenArray(self.tax_at)
+        self.net_at_array = _frozenArray(self.net_at)
+        self.net_upper_array = _frozenArray(self.net_uppers)
+        self._key = (self.floor, self.uppers, self.rates)
+        self._hash = hash(self._key)
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, "_frozen", False):
+            raise AttributeError(f"TaxSchedule is immutable; cannot set {name!r}")
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        raise AttributeError(f"TaxSchedule is immutable; cannot delete {name!r}")
+
+    def __eq__(self, other):
+        if not isinstance(other, TaxSchedule):
+            return NotImplemented
+        return self._key == other._key
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        # rebuilt from the definition, so an unpickled copy is frozen too
+        return (TaxSchedule, self.definition())
+
+    def definition(self):
+        # back to the tax_brackets/tax_rates shape
+        brackets = {0: self.floor}
+        rates = {}
+        for i, (upper, rate) in enumerate(zip(self.uppers, self.rates), start=1):
+            brackets[i] = upper
+            rates[i] = rate
+        return brackets, rates
+
+    def fingerprint(self):
+        # stable across processes and runs, for tagging files derived from a schedule
+        return hashlib.sha256(repr((self.floor, list(self.uppers), list(self.rates))).encode()).hexdigest()
+
+    def bracket(self, income):
+        return bisect_left(self.uppers, income)
+
+    def netIncome(self, income):
+        if income < self.floor:
+            return "You're in debt!"
+        if income <= self.tax_free:
+            return income
+        j = self.bracket(income)
+        net = self.net_at[j] + (income - self.lowers[j])*self.keeps[j]
+        return round(net, 2)
+
+    def netIncomeInverse(self, net_income):
+        # one search over the net income at each threshold, then one linear solve
+        if not net_income > 0:
+            raise ValueError(f"net income must be positive, got {net_income!r}")
+        j = bisect_left(self.net_uppers, net_income)
+        keep = self.keeps[j]
+        return (net_income - self.net_at[j] + keep*self.lowers[j])/keep
+
+    def taxPaidGross(self, income):
+        if income < self.floor:
+            raise ValueError(f"gross income must be at least {self.floor}, got {income!r}")
+        net_income = self.netIncome(income)
+        return round(income - net_income, 2)
+
+    def taxPaidNet(self, net_income):
+        gross = self.netIncomeInverse(net_income)
+        return round(gross - net_income, 2)
+
+    # the notebook's curves: value of the next dollar, average return on each
+    # dollar, and the percentage by which the average exceeds the marginal value
+
+    def marginalValue(self, income):
+        return self.keeps[self.bracket(income)]
+
+    def aveReturn(self, income):
+        return self.netIncome(income)/income
+
+    def premium(self, income):
+        average = self.aveReturn(income)
+        marginal = self.marginalValue(income)
+        return round(100*((average - marginal)/average), 2)
+
+    def segments(self):
+        return [
+            CurveSegment(lower, upper, keep, net - keep*lower)
+            for lower, upper, keep, net in zip(self.lowers, self.uppers, self.keeps, self.net_at)
+        ]
+
+    # Array versions: whole ndarrays in, ndarrays out. Entries the scalar
+    # functions would reject (negative incomes, non-positive net incomes) come back as nan.
+    # Pass return_valid=True to the inverse to also get the mask of accepted entries.
+
+    def bracketArray(self, incomes):
+        # index into lowers/uppers/rates of each income's bracket
+        j = np.searchsorted(self.upper_array, incomes)
+        return np.minimum(j, len(self.uppers) - 1, out=j)
+
+    def taxArray(self, incomes):
+        # exact, unrounded tax, for aggregates where cent rounding per person is noise
+        incomes = np.asarray(incomes, dtype=float)
+        j = self.bracketArray(incomes)
+        return self.tax_at_array[j] + (incomes - self.lower_array[j])*self.rate_array[j]
+
+    def netIncomeArray(self, incomes):
+        incomes = np.asarray(incomes, dtype=float)
+        j = self.bracketArray(incomes)
+        net = self.net_at_array[j] + (incomes - self.lower_array[j])*self.keep_array[j]
+        net = np.where(incomes <= self.tax_free, incomes, _roundCents(net))
+        return np.where(incomes < self.floor, np.nan, net)
+
+    def netIncomeInverseArray(self, net_incomes, return_valid=False):
+        net_incomes = np.asarray(net_incomes, dtype=float)
+        valid = net_incomes > 0
+        j = np.searchsorted(self.net_upper_array, net_incomes)
+        np.minimum(j, len(self.uppers) - 1, out=j)
+        keep = self.keep_array[j]
+        with np.errstate(over="ignore"):
+            gross = (net_incomes - self.net_at_array[j] + keep*self.lower_array[j])/keep
+        gross = np.where(valid, gross, np.nan)
+        if return_valid:
+            return gross, valid
+        return gross
+
+    def taxPaidGrossArray(self, incomes):
+        incomes = np.asarray(incomes, dtype=float)
+        # an infinite income leaves inf - inf = nan, as the scalar path does
+        with np.errstate(invalid="ignore"):
+            return _roundCents(incomes - self.netIncomeArray(incomes))
+
+    def taxPaidNetArray(self, net_incomes):
+        net_incomes = np.asarray(net_incomes, dtype=float)
+        with np.errstate(invalid="ignore"):
+            return _roundCents(self.netIncomeInverseArray(net_incomes) - net_incomes)
+
+    def marginalValueArray(self, incomes):
+        return self.keep_array[self.bracketArray(np.asarray(incomes, dtype=float))]
+
+    def aveReturnArray(self, incomes):
+        incomes = np.asarray(incomes, dtype=float)
+        return self.netIncomeArray(incomes)/incomes
+
+    def premiumArray(self, incomes):
+        average = self.aveReturnArray(incomes)
+        marginal = self.marginalValueArray(incomes)
+        return _roundCents(100*((average - marginal)/average))
+
+    # Target solvers: the income at which the unrounded tax, the average rate
+    # or the net-to-gross ratio reaches a target. On bracket j the tax is the
+    # line rate*income + intercept, so each bracket has at most one closed-form
+    # solution; the answer is the lowest solution lying inside its own bracket.
+    # Where a whole bracket attains the target (a zero rate), its upper threshold
+    # is returned. Unreachable targets come back as nan, and return_valid=True
+    # also gives the mask of targets that were reached.
+
+    def _solve(self, targets, average, return_valid):
+        targets = np.asarray(targets, dtype=float)
+        flat = targets.reshape(-1, 1)
+        lowers = self.lower_array[None, :]
+        uppers = self.upper_array[None, :]
+        intercepts = (self.tax_at_array - self.rate_array*self.lower_array)[None, :]
+        result = np.empty(len(flat))
+        block = max(1, SOLVE_BLOCK // len(self.uppers))
+        for start in range(0, len(flat), block):
+            target = flat[start:start + block]
+            if average:
+                top, bottom = np.broadcast_arrays(intercepts, target - self.rate_array[None, :])
+            else:
+                top, bottom = np.broadcast_arrays(target - intercepts, self.rate_array[None, :])
+            with np.errstate(divide="ignore", invalid="ignore"):
+                incomes = top/bottom
+            whole = (bottom == 0) & (top == 0)
+            incomes = np.where(whole, np.where(np.isfinite(uppers), uppers, lowers), incomes)
+            # a solution on a threshold can land a hair outside either bracket
+            slack = 1e-9*np.maximum(1, np.abs(incomes))
+            inside = np.isfinite(incomes) & (incomes >= lowers - slack) & (incomes <= uppers + slack)
+            if average:
+                inside &= incomes > 0
+            incomes = np.where(inside, np.clip(incomes, lowers, uppers), np.inf)
+            result[start:start + block] = incomes.min(axis=1)
+        valid = np.isfinite(result).reshape(targets.shape)
+        result = np.where(valid, result.reshape(targets.shape), np.nan)
+        if return_valid:
+            return result, valid
+        return result
+
+    def incomeForTaxArray(self, taxes, return_valid=False):
+        # rate*income + intercept = tax
+        return self._solve(taxes, False, return_valid)
+
+    def incomeForAverageRateArray(self, average_rates, return_valid=False):
+        # rate*income + intercept = average_rate*income
+        return self._solve(average_rates, True, return_valid)
+
+    def incomeForNetRatioArray(self, ratios, return_valid=False):
+        # net/gross = ratio is an average rate of 1 - ratio
+        return self.incomeForAverageRateArray(1 - np.asarray(ratios, dtype=float), return_valid)
+
+default_schedule = TaxSchedule(tax_brackets, tax_rates)
+
+def setDefaultSchedule(schedule):
+    # Swaps in a new default. Rebinding a name is atomic and schedules are
+    # immutable, so calculations already running keep the schedule they started with.
+    global default_schedule, tax_brackets, tax_rates
+    schedule = resolveSchedule(schedule)
+    brackets, rates = schedule.definition()
+    default_schedule = schedule
+    tax_brackets = MappingProxyType(brackets)
+    tax_rates = MappingProxyType(rates)
+    return schedule
+
+# Levies and offsets on top of the brackets. Each is piecewise linear in
+# income: straight lines between points, then final_slope beyond the last
+# point. Levies add to the tax. Offsets reduce the bracket tax but never below
+# zero. compileSchedule folds them with the brackets into one TaxSchedule,
+# so a lookup still costs one search and one multiply-add however many are stacked.
+Component = namedtuple("Component", ["name", "kind", "points", "final_slope"])
+
+def levy(name, points, final_slope=0):
+    return Component(name, "levy", tuple(points), final_slope)
+
+def offset(name, points, final_slope=0):
+    return Component(name, "offset", tuple(points), final_slope)
+
+def medicareLevy(rate=0.02, threshold=26000, shade_in=0.1):
+    # nothing up to threshold, shade_in of the excess until that reaches rate of income
+    full = threshold*shade_in/(shade_in - rate)
+    return levy("medicare", [(0, 0), (threshold, 0), (full, rate*full)], rate)
+
+def lowIncomeTaxOffset():
+    # 2020-21 onwards: $700, less 5c per dollar over $37,500 and 1.5c per dollar over $45,000
+    return offset("lito", [(0, 700), (37500, 700), (45000, 325), (66667, 0)])
+
+def _componentAt(component, income):
+    points = component.points
+    if income >= points[-1][0]:
+        return points[-1][1] + component.final_slope*(income - points[-1][0])
+    j = bisect_left([x for x, _ in points], income)
+    if points[j][0] == income or j == 0:
+        return points[j][1]
+    (x0, y0), (x1, y1) = points[j - 1], points[j]
+    return y0 + (y1 - y0)*(income - x0)/(x1 - x0)
+
+def _componentSlope(component, lower, upper):
+    # slope on (lower, upper), which lies between consecutive breakpoints
+    points = component.points
+    if lower >= points[-1][0]:
+        return component.final_slope
+    j = bisect_left([x for x, _ in points], upper)
+    if j == 0:
+        return 0
+    (x0, y0), (x1, y1) = points[j - 1], points[j]
+    return (y1 - y0)/(x1 - x0)
+
+def compileSchedule(brackets, rates, components=()):
+    # Merge the bracket thresholds and every component's points into one
+    # breakpoint table with a single marginal rate per segment.
+    base = TaxSchedule(brackets, rates)
+    if not components:
+        return base
+    offsets = [c for c in components if c.kind == "offset"]
+    levies = [c for c in components if c.kind == "levy"]
+    if len(offsets) + len(levies) != len(components):
+        raise ValueError("component kind must be 'levy' or 'offset'")
+
+    def bracketTax(x):
+        j = base.bracket(x)
+        return base.tax_at[j] + base.rates[j]*(x - base.lowers[j])
+
+    def reduced(x):
+        return bracketTax(x) - sum(_componentAt(c, x) for c in offsets)
+
+    points = {x for x in base.lowers}
+    points |= {x for c in components for x, _ in c.points if x > base.floor}
+    points = sorted(x for x in points if x != math.inf)
+    # split wherever offsets take the bracket tax through zero
+    crossings = []
+    for a, b in zip(points, points[1:]):
+        fa, fb = reduced(a), reduced(b)
+        if (fa < 0) != (fb < 0):
+            crossings.append(a - fa*(b - a)/(fb - fa))
+    last = points[-1]
+    slope = base.rates[-1] - sum(c.final_slope for c in offsets)
+    if reduced(last) < 0 < slope:
+        crossings.append(last - reduced(last)/slope)
+    points = sorted(set(points) | set(crossings))
+
+    combined_brackets = {0: base.floor}
+    combined_rates = {}
+    edges = points[1:] + [math.inf]
+    for i, (lower, upper) in enumerate(zip(points, edges), start=1):
+        middle = lower + 1 if upper == math.inf else (lower + upper)/2
+        rate = sum(_componentSlope(c, lower, upper) for c in levies)
+        if reduced(middle) > 0:
+            rate += base.rates[base.bracket(middle)]
+            rate -= sum(_componentSlope(c, lower, upper) for c in offsets)
+        if rate >= 1:
+            raise ValueError(f"combined marginal rate {rate} on ({lower}, {upper}] leaves no net income")
+        combined_brackets[i] = upper
+        combined_rates[i] = rate
+    return TaxSchedule(combined_brackets, combined_rates)
+
+# A registered schedule: brackets and rates in the shape of tax_brackets/tax_rates,
+# plus any levies and offsets. Entries are replaced whole, never edited, so a
+# reader always sees one consistent registration.
+Registration = namedtuple("Registration", ["brackets", "rates", "components"])
+
+def _registration(brackets, rates, components=()):
+    return Registration(MappingProxyType(dict(brackets)), MappingProxyType(dict(rates)), tuple(components))
+
+# Resident rates by financial year.
+schedule_registry = {
+    "2019-20": (
+        {0: 0, 1: 18200, 2: 37000, 3: 90000, 4: 180000, 5: math.inf},
+        {1: 0, 2: 0.19, 3: 0.325, 4: 0.37, 5: 0.45}
+    ),
+    "2020-21": (
+        {0: 0, 1: 18200, 2: 45000, 3: 120000, 4: 180000, 5: math.inf},
+        {1: 0, 2: 0.19, 3: 0.325, 4: 0.37, 5: 0.45}
+    ),
+    "2021-22": (
+        {0: 0, 1: 18200, 2: 45000, 3: 120000, 4: 180000, 5: math.inf},
+        {1: 0, 2: 0.19, 3: 0.325, 4: 0.37, 5: 0.45}
+    ),
+    "2022-23": (
+        {0: 0, 1: 18200, 2: 45000, 3: 120000, 4: 180000, 5: math.inf},
+        {1: 0, 2: 0.19, 3: 0.325, 4: 0.37, 5: 0.45}
+    ),
+    "2023-24": (
+        {0: 0, 1: 18200, 2: 45000, 3: 120000, 4: 180000, 5: math.inf},
+        {1: 0, 2: 0.19, 3: 0.325, 4: 0.37, 5: 0.45}
+    ),
+    "2024-25": (
+        {0: 0, 1: 18200, 2: 45000, 3: 135000, 4: 190000, 5: math.inf},
+        {1: 0, 2: 0.16, 3: 0.30, 4: 0.37, 5: 0.45}
+    ),
 }
+schedule_registry = {name: _registration(*definition) for name, definition in schedule_registry.items()}
 
-def netIncome(income):
-    if income < tax_brackets[0]:
-        return "You're in debt!"
-    if income <= tax_brackets[1]:
-        return income
-    for i in tax_brackets:
-        if income <= tax_brackets[i]:            
-            nat_accum = [(1- tax_rates[j])*(tax_brackets[j] - tax_brackets[j-1]) for j in range(1, i)]
-            net = sum(nat_accum) + (income - tax_brackets[i-1])*(1-tax_rates[i])
-            return round(net, 2)
-
-def netIncomeInverse(net_income):
-    if net_income  <= 0:
-        return "Get outta here!"
-    
-    bracket = 0
-    for i in tax_brackets:
-        if net_income <= tax_brackets[i]:
-            bracket = i
-            break
-    
-    def solver(index):
-        if index == 1:
-            return net_income
-        
-        threshhold = tax_brackets[index-1]
-        rate = 1-tax_rates[index]
-        
-        tot_income = (net_income - netIncome(threshhold) + rate*(threshhold))/rate
-        if tot_income <= tax_brackets[index]:
-            return tot_income
-        else:
-            return solver(index + 1)
-        
-    return solver(bracket)
-    
-def taxPaid(income):
+SCHEDULE_CACHE_SIZE = 32
+
+def registerSchedule(name, brackets, rates, components=()):
+    schedule_registry[name] = _registration(brackets, rates, components)
+
+def financialYear(date):
+    # Australian financial years run from 1 July to 30 June
+    start = date.year if date.month >= 7 else date.year - 1
+    return f"{start}-{(start + 1) % 100:02d}"
+
+@lru_cache(maxsize=SCHEDULE_CACHE_SIZE)
+def _compileSchedule(brackets, rates, components=()):
+    return compileSchedule(dict(brackets), dict(rates), components)
+
+def getSchedule(name):
+    # name is a registered key such as "2019-20", or a date within a financial year
+    if isinstance(name, datetime.date):
+        name = financialYear(name)
+    registration = schedule_registry.get(name)
+    if registration is None:
+        raise KeyError(f"no tax schedule registered for {name!r}")
+    brackets, rates, components = registration
+    # keyed on the contents, so re-registering a name never serves a stale compile
+    return _compileSchedule(tuple(brackets.items()), tuple(rates.items()), components)
+
+def resolveSchedule(schedule=None):
+    if schedule is None:
+        return default_schedule
+    if isinstance(schedule, TaxSchedule):
+        return schedule
+    return getSchedule(schedule)
+
+def netIncome(income, schedule=None):
+    return resolveSchedule(schedule).netIncome(income)
+
+def netIncomeInverse(net_income, schedule=None):
+    return resolveSchedule(schedule).netIncomeInverse(net_income)
+
+def taxPaid(amount, basis="gross", schedule=None):
+    # no I/O: basis says whether amount is a gross or a net income.
+    # Arrays go through the vectorized paths.
+    schedule = resolveSchedule(schedule)
+    array = np.ndim(amount) > 0
+    if basis == "gross":
+        return schedule.taxPaidGrossArray(amount) if array else schedule.taxPaidGross(amount)
+    if basis == "net":
+        return schedule.taxPaidNetArray(amount) if array else schedule.taxPaidNet(amount)
+    raise ValueError(f"basis must be 'gross' or 'net', got {basis!r}")
+
+def askBasis():
+    # the interactive question taxPaid used to ask; for the command line only
     print("Is this (1) net income or (2) gross income? \nPlease enter 1 or 2 accordingly.")
-    ans = int(input().strip())
-    if ans == 1:
-        gross = netIncomeInverse(income)
-        return round(gross - income, 2)
-    if ans == 2:
-        net_income = netIncome(income)
-        return round(income - net_income, 2)
+    ans = input().strip()
+    if ans == "1":
+        return "net"
+    if ans == "2":
+        return "gross"
+    raise ValueError(f"expected 1 or 2, got {ans!r}")
+
+def taxPaidNet(income, schedule=None):
+    return resolveSchedule(schedule).taxPaidNet(income)
+
+def taxPaidGross(income, schedule=None):
+    return resolveSchedule(schedule).taxPaidGross(income)
+
+def netIncomeArray(incomes, schedule=None):
+    return resolveSchedule(schedule).netIncomeArray(incomes)
+
+def netIncomeInverseArray(net_incomes, return_valid=False, schedule=None):
+    return resolveSchedule(schedule).netIncomeInverseArray(net_incomes, return_valid)
+
+def taxPaidGrossArray(incomes, schedule=None):
+    return resolveSchedule(schedule).taxPaidGrossArray(incomes)
+
+def taxPaidNetArray(net_incomes, schedule=None):
+    return resolveSchedule(schedule).taxPaidNetArray(net_incomes)
+
+def marginalValue(income, schedule=None):
+    return resolveSchedule(schedule).marginalValue(income)
+
+def aveReturn(income, schedule=None):
+    return resolveSchedule(schedule).aveReturn(income)
+
+def premium(income, schedule=None):
+    return resolveSchedule(schedule).premium(income)
+
+def marginalValueArray(incomes, schedule=None):
+    return resolveSchedule(schedule).marginalValueArray(incomes)
+
+def aveReturnArray(incomes, schedule=None):
+    return resolveSchedule(schedule).aveReturnArray(incomes)
+
+def premiumArray(incomes, schedule=None):
+    return resolveSchedule(schedule).premiumArray(incomes)
+
+def incomeForTaxArray(taxes, return_valid=False, schedule=None):
+    return resolveSchedule(schedule).incomeForTaxArray(taxes, return_valid)
+
+def incomeForAverageRateArray(average_rates, return_valid=False, schedule=None):
+    return resolveSchedule(schedule).incomeForAverageRateArray(average_rates, return_valid)
+
+def incomeForNetRatioArray(ratios, return_valid=False, schedule=None):
+    return resolveSchedule(schedule).incomeForNetRatioArray(ratios, return_valid)
+
+def curveSegments(schedule=None):
+    return resolveSchedule(schedule).segments()
+
+def _hyperbolaPoints(lower, upper, scale, shift, tolerance, resolution):
+    # Points on [lower, upper] such that joining them with straight lines stays
+    # within tolerance of scale/(x + shift). The chord over [a, b] is furthest
+    # from it at sqrt((a + shift)*(b + shift)) - shift, by
+    # |scale|*(1/sqrt(a + shift) - 1/sqrt(b + shift))**2, so each step is solved directly.
+    points = [lower]
+    if scale == 0:
+        return points + [upper]
+    step = math.sqrt(tolerance/abs(scale))
+    x = lower
+    while x < upper:
+        root = 1/math.sqrt(x + shift) - step
+        following = upper if root <= 0 else 1/root**2 - shift
+        x = min(max(following, x + resolution), upper)
+        points.append(x)
+    return points
+
+def sampleCurve(curve, start=1, stop=300000, tolerance=1e-4, resolution=1, schedule=None):
+    # (incomes, values) to plot curve over [start, stop] as a piecewise-linear
+    # line, using only as many points as tolerance (largest vertical error) and
+    # resolution (smallest spacing worth emitting) call for. Cost is
+    # O(brackets + points), not O(dollars).
+    schedule = resolveSchedule(schedule)
+    functions = {
+        "netIncome": schedule.netIncomeArray,
+        "marginalValue": schedule.marginalValueArray,
+        "aveReturn": schedule.aveReturnArray,
+        "premium": schedule.premiumArray,
+    }
+    if curve not in functions:
+        raise ValueError(f"curve must be one of {sorted(functions)}, got {curve!r}")
+    if not 0 < start < stop:
+        raise ValueError(f"need 0 < start < stop, got {start} and {stop}")
+    incomes = []
+    for segment in schedule.segments():
+        lower = max(segment.lower, start)
+        upper = min(segment.upper, stop)
+        if lower >= upper:
+            continue
+        if curve in ("netIncome", "marginalValue") or segment.intercept == 0:
+            points = [lower, upper]
+        elif curve == "aveReturn":
+            points = _hyperbolaPoints(lower, upper, segment.intercept, 0, tolerance, resolution)
+        elif segment.marginal == 0:
+            points = [lower, upper]
+        else:
+            shift = segment.intercept/segment.marginal
+            points = _hyperbolaPoints(lower, upper, 100*shift, shift, tolerance, resolution)
+        if curve in ("marginalValue", "premium") and lower > start:
+            # these jump at each threshold: start just past it so the jump is drawn vertically
+            points[0] = math.nextafter(lower, math.inf)
+        elif incomes and incomes[-1] == points[0]:
+            points = points[1:]
+        incomes.extend(points)
+    incomes = np.array(incomes, dtype=float)
+    return incomes, functions[curve](incomes)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m tax")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    batch_parser = commands.add_parser("batch", help="compute net income and tax paid for a CSV/TSV file")
+    batch_parser.add_argument("input", help="input CSV or TSV file with a header row")
+    batch_parser.add_argument("output", help="where to write the input rows plus the computed columns")
+    batch_parser.add_argument("--column", default="income", help="name or position of the income column")
+    batch_parser.add_argument("--basis", choices=["gross", "net"], default="gross", help="whether the column holds gross or net income")
+    batch_parser.add_argument("--chunk-size", type=int, default=100000, help="rows held in memory at once")
+    batch_parser.add_argument("--schedule", help="registered schedule name, e.g. 2019-20")
+    batch_parser.add_argument("--delimiter", help="field delimiter (default: tab for .tsv, else comma)")
+    batch_parser.add_argument("--workers", type=int, default=1, help="processes to split each chunk across")
+    batch_parser.add_argument("--cache", help="directory caching each chunk's results, keyed by its inputs and the schedule")
+    batch_parser.add_argument("--cache-max-mb", type=float, default=1024, help="evict least recently used chunks past this size")
+    batch_parser.add_argument("--resume", action="store_true", help="continue an interrupted run from its last complete chunk")
+
+    paid_parser = commands.add_parser("paid", help="tax paid on a single income")
+    paid_parser.add_argument("amount", type=float, help="the income")
+    paid_parser.add_argument("--basis", choices=["gross", "net"], help="whether the income is gross or net (asked if omitted)")
+    paid_parser.add_argument("--schedule", help="registered schedule name, e.g. 2019-20")
+
+    serve_parser = commands.add_parser("serve", help="run the HTTP calculation service")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument("--max-batch-size", type=int, default=1024, help="most requests evaluated together")
+    serve_parser.add_argument("--max-latency-ms", type=float, default=2.0, help="longest a request waits for its batch to fill")
+    serve_parser.add_argument("--instrument", action="store_true", help="record per-function counters, served at /metrics")
+
+    table_parser = commands.add_parser("table", help="build a memory-mapped lookup table of whole-dollar incomes")
+    table_parser.add_argument("output", help="where to write the table")
+    table_parser.add_argument("--ceiling", type=int, default=2000000, help="highest whole-dollar income in the table")
+    table_parser.add_argument("--schedule", help="registered schedule name, e.g. 2019-20")
+
+    payg_parser = commands.add_parser("payg", help="generate weekly, fortnightly and monthly withholding tables")
+    payg_parser.add_argument("directory", help="where to write the tables")
+    payg_parser.add_argument("--schedule", help="registered schedule name, e.g. 2019-20")
+    payg_parser.add_argument("--max-annual", type=float, default=500000, help="highest annualised earnings covered")
+    payg_parser.add_argument("--formats", nargs="+", choices=["bin", "csv"], default=["bin", "csv"])
 
-def taxPaidNet(income):
-    gross = netIncomeInverse(income)
-    return round(gross - income, 2)
+    args = parser.parse_args(argv)
+    if args.command == "payg":
+        import withholding
+        withholding.run(args)
+    if args.command == "table":
+        import lookup
+        lookup.run(args)
+    if args.command == "serve":
+        import service
+        service.run(args)
+    if args.command == "batch":
+        import batch
+        batch.run(args)
+    if args.command == "paid":
+        basis = args.basis or askBasis()
+        try:
+            print(taxPaid(args.amount, basis, args.schedule))
+        except ValueError as error:
+            paid_parser.error(str(error))
 
-def taxPaidGross(income):
-    net_income = netIncome(income)
-    return round(income - net_income, 2)
-    
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+import hashlib
+import json
+import math
+import os
+import struct
+
+import numpy as np
+
+import tax
+
+# Year-to-date withholding. Each pay event annualises the employee's
+# year-to-date gross, looks up the annual tax on that, and withholds the
+# difference between the pro-rata share of it and what has already been
+# withheld. State is columnar: one array per field, one row per employee.
+#
+#     tracker = withholding.WithholdingTracker(periods_per_year=26)
+#     tracker.apply(1001, 2500.00)                 # one pay event
+#     tracker.applyRun(employee_ids, grosses)      # a whole pay run
+
+PERIODS = {"weekly": 52, "fortnightly": 26, "monthly": 12}
+
+class WithholdingTracker:
+
+    def __init__(self, schedule=None, periods_per_year=PERIODS["fortnightly"], capacity=1024):
+        self.schedule = tax.resolveSchedule(schedule)
+        self.periods_per_year = periods_per_year
+        self.size = 0
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.ytd_gross = np.zeros(capacity)
+        self.ytd_tax = np.zeros(capacity)
+        self.periods = np.zeros(capacity, dtype=np.int32)
+        # (ids in sorted order, row of each), kept in step as employees are added
+        self._sorted = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+
+    def _grow(self, needed):
+        capacity = len(self.ids)
+        if needed <= capacity:
+            return
+        capacity = max(needed, 2*capacity)
+        for name in ("ids", "ytd_gross", "ytd_tax", "periods"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def _find(self, ids):
+        # row of each id, or -1 where the id is not yet known
+        sorted_ids, order = self._sorted
+        if not len(sorted_ids):
+            return np.full(len(ids), -1, dtype=np.int64)
+        found = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        return np.where(sorted_ids[found] == ids, order[found], -1)
+
+    def addEmployees(self, ids):
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        ids = ids[self._find(ids) < 0]
+        new = np.sort(ids)
+        if np.any(new[1:] == new[:-1]):
+            raise ValueError("employee ids must be unique")
+        self._grow(self.size + len(ids))
+        rows = np.arange(self.size, self.size + len(ids), dtype=np.int64)
+        self.ids[self.size:self.size + len(ids)] = ids
+        # rows above size can hold stale figures after a restore, so start new ones at zero
+        self.ytd_gross[self.size:self.size + len(ids)] = 0
+        self.ytd_tax[self.size:self.size + len(ids)] = 0
+        self.periods[self.size:self.size + len(ids)] = 0
+        self.size += len(ids)
+        # merge the new ids into the sorted index rather than re-sorting everything
+        sorted_ids, order = self._sorted
+        positions = np.searchsorted(sorted_ids, new)
+        self._sorted = (np.insert(sorted_ids, positions, new), np.insert(order, positions, rows[np.argsort(ids, kind="stable")]))
+
+    def rowsFor(self, ids):
+        # vectorized id -> row, adding employees seen for the first time
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+        rows = self._find(ids)
+        if np.any(rows < 0):
+            self.addEmployees(np.unique(ids[rows < 0]))
+            rows = self._find(ids)
+        return rows
+
+    def _row(self, employee):
+        row = int(self._find(np.array([employee], dtype=np.int64))[0])
+        if row < 0:
+            raise KeyError(employee)
+        return row
+
+    def _withhold(self, ytd_gross, periods, ytd_tax):
+        # pro-rata share of the annual tax on the annualised year-to-date gross
+        annualised = ytd_gross*self.periods_per_year/periods
+        due = self.schedule.taxPaidGrossArray(annualised)*periods/self.periods_per_year
+        return np.maximum(tax._roundCents(due - ytd_tax), 0)
+
+    def apply(self, employee, gross):
+        # Python floats throughout, so round() here matches _roundCents in applyRun
+        row = int(self.rowsFor([employee])[0])
+        ytd_gross = float(self.ytd_gross[row]) + gross
+        periods = int(self.periods[row]) + 1
+        annualised = ytd_gross*self.periods_per_year/periods
+        due = self.schedule.taxPaidGross(annualised)*periods/self.periods_per_year
+        withheld = max(round(due - float(self.ytd_tax[row]), 2), 0.0)
+        self.ytd_gross[row] = ytd_gross
+        self.ytd_tax[row] += withheld
+        self.periods[row] = periods
+        return withheld
+
+    def applyRun(self, ids, grosses):
+        # one pay event for each employee in ids, as a single vectorized update
+        rows = self.rowsFor(ids)
+        if len(rows) and np.bincount(rows).max() > 1:
+            raise ValueError("an employee can appear only once per pay run")
+        grosses = np.asarray(grosses, dtype=float).reshape(-1)
+        ytd_gross = self.ytd_gross[rows] + grosses
+        periods = self.periods[rows] + 1
+        withheld = self._withhold(ytd_gross, periods, self.ytd_tax[rows])
+        self.ytd_gross[rows] = ytd_gross
+        self.ytd_tax[rows] += withheld
+        self.periods[rows] = periods
+        return withheld
+
+    def state(self, employee):
+        row = self._row(employee)
+        return {
+            "ytd_gross": float(self.ytd_gross[row]),
+            "ytd_tax": float(self.ytd_tax[row]),
+            "periods": int(self.periods[row]),
+        }
+
+    def snapshot(self):
+        # copies of the live columns; cheap, and safe to keep while the tracker moves on
+        return {
+            "ids": self.ids[:self.size].copy(),
+            "ytd_gross": self.ytd_gross[:self.size].copy(),
+            "ytd_tax": self.ytd_tax[:self.size].copy(),
+            "periods": self.periods[:self.size].copy(),
+        }
+
+    def restore(self, snapshot):
+        self.size = 0
+        self._sorted = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        self._grow(len(snapshot["ids"]))
+        self.addEmployees(snapshot["ids"])
+        self.ytd_gross[:self.size] = snapshot["ytd_gross"]
+        self.ytd_tax[:self.size] = snapshot["ytd_tax"]
+        self.periods[:self.size] = snapshot["periods"]
+
+    def save(self, path):
+        np.savez(path, periods_per_year=self.periods_per_year, **self.snapshot())
+
+    @classmethod
+    def load(cls, path, schedule=None):
+        with np.load(path) as data:
+            tracker = cls(schedule, int(data["periods_per_year"]), max(len(data["ids"]), 1))
+            tracker.restore({name: data[name] for name in ("ids", "ytd_gross", "ytd_tax", "periods")})
+        return tracker
+
+# PAYG tables: the amount withheld from each whole-dollar amount of earnings
+# in a pay period, for each period and each scale. Each table comes straight
+# from the compiled breakpoints: earnings annualised, taxed, divided back
+# and rounded to the dollar, all as one array operation.
+
+VARIANTS = ("tax_free_threshold", "no_tax_free_threshold")
+TABLE_MAGIC = b"PAYGTB\x00\x01"
+# magic, periods per year, highest earnings, sha256 of the table's key
+TABLE_HEADER = struct.Struct("<8sIq32s")
+TABLE_HEADER_SIZE = 64
+MANIFEST = "manifest.json"
+
+def variantSchedule(schedule, variant):
+    # without the tax-free threshold, the first bracket is taxed at the second bracket's rate
+    if variant == "tax_free_threshold":
+        return schedule
+    if variant == "no_tax_free_threshold":
+        brackets, rates = schedule.definition()
+        first = min(rates)
+        if rates[first] == 0 and first + 1 in rates:
+            rates[first] = rates[first + 1]
+        return tax.TaxSchedule(brackets, rates)
+    raise ValueError(f"variant must be one of {VARIANTS}, got {variant!r}")
+
+def withholdingTable(schedule, periods_per_year, max_earnings):
+    # whole dollars withheld from earnings of 0, 1, ..., max_earnings in one period
+    earnings = np.arange(max_earnings + 1, dtype=float)
+    per_period = schedule.taxArray(earnings*periods_per_year)/periods_per_year
+    return np.floor(per_period + 0.5).astype(np.uint32)
+
+def tableKey(schedule, period, variant, max_earnings):
+    # changes whenever anything the table depends on changes
+    return f"{schedule.fingerprint()}:{period}:{variant}:{max_earnings}"
+
+def writeTableBinary(path, table, periods_per_year, key):
+    header = TABLE_HEADER.pack(TABLE_MAGIC, periods_per_year, len(table) - 1,
+                               hashlib.sha256(key.encode()).digest())
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(header.ljust(TABLE_HEADER_SIZE, b"\0"))
+        f.write(table.astype("<u4").tobytes())
+    os.replace(temporary, path)
+
+def readTableBinary(path, key=None):
+    # with key, also checks the table was built from it
+    with open(path, "rb") as f:
+        magic, periods_per_year, max_earnings, digest = TABLE_HEADER.unpack(f.read(TABLE_HEADER.size))
+    if magic != TABLE_MAGIC:
+        raise ValueError(f"{path} is not a PAYG table")
+    if key is not None and digest != hashlib.sha256(key.encode()).digest():
+        raise ValueError(f"{path} was built from a different schedule or layout")
+    return np.fromfile(path, dtype="<u4", offset=TABLE_HEADER_SIZE, count=max_earnings + 1)
+
+def writeTableCsv(path, table):
+    earnings = np.arange(len(table))
+    lines = np.char.add(np.char.add(earnings.astype(str), ","), table.astype(str))
+    temporary = path + ".tmp"
+    with open(temporary, "w") as f:
+        f.write("earnings,withholding\n")
+        f.write("\n".join(lines.tolist()))
+        f.write("\n")
+    os.replace(temporary, path)
+
+def generateTables(directory, schedule=None, periods=PERIODS, variants=VARIANTS,
+                   max_annual=500000, formats=("bin", "csv")):
+    # Writes every period x variant table into directory. A manifest records
+    # the key each file was built from, so files that are already up to date
+    # are skipped. Returns the names of the tables written.
+    schedule = tax.resolveSchedule(schedule)
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    written = []
+    for variant in variants:
+        variant_schedule = variantSchedule(schedule, variant)
+        for period, periods_per_year in periods.items():
+            max_earnings = math.ceil(max_annual/periods_per_year)
+            name = f"{period}-{variant}"
+            key = tableKey(variant_schedule, period, variant, max_earnings)
+            # extension -> key, one entry per file, since a run may write only some formats
+            built = manifest.get(name)
+            if not isinstance(built, dict):
+                built = manifest[name] = {}
+            stale = [extension for extension in formats
+                     if built.get(extension) != key or not os.path.exists(os.path.join(directory, f"{name}.{extension}"))]
+            if not stale:
+                continue
+            table = withholdingTable(variant_schedule, periods_per_year, max_earnings)
+            if "bin" in stale:
+                writeTableBinary(os.path.join(directory, f"{name}.bin"), table, periods_per_year, key)
+            if "csv" in stale:
+                writeTableCsv(os.path.join(directory, f"{name}.csv"), table)
+            for extension in stale:
+                built[extension] = key
+            written.append(name)
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return written
+
+def run(args):
+    written = generateTables(args.directory, args.schedule, max_annual=args.max_annual,
+                             formats=tuple(args.formats))
+    print(f"Wrote {len(written)} tables" + (": " + ", ".join(written) if written else " (all up to date)"))